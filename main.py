@@ -16,13 +16,28 @@ Requires: .env file (see .env.example) and a Supabase project with schema.sql ap
 import os
 import re
 import io
+import sys
+import zlib
+import hashlib
+import socket
+import base64
+import itertools
 import time
 import json
 import asyncio
 import logging
+import heapq
+import functools
+import bisect
+import math
+import random
 import datetime
+import uuid
 import traceback
-from typing import Optional, Literal
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from collections import OrderedDict, deque
+from typing import Callable, Optional, Literal
 
 import discord
 from discord import app_commands
@@ -39,6 +54,16 @@ try:
 except ImportError:
     aioredis = None
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 # ------------------------------------------------------------------
 # ENV / CONFIG
 # ------------------------------------------------------------------
@@ -79,6 +104,112 @@ logger.addHandler(_console_handler)
 # ------------------------------------------------------------------
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# ------------------------------------------------------------------
+# DATA ACCESS LAYER
+# ------------------------------------------------------------------
+# supabase-py's `.execute()` is a blocking HTTP call. Running it directly
+# inside an event handler stalls the whole event loop (gateway heartbeats
+# included) for as long as Supabase takes to answer. Every query therefore
+# goes through `db.table(...)`, which builds the query exactly like
+# `supabase.table(...)` but runs `.execute()` on a bounded thread pool, with
+# a per-table concurrency cap so one hot table can't starve the others.
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", 16))
+DB_TABLE_CONCURRENCY = int(os.getenv("DB_TABLE_CONCURRENCY", 8))
+
+
+class _TableStats:
+    __slots__ = ("calls", "errors", "queued", "in_flight", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.queued = 0       # waiting for a table slot / worker thread
+        self.in_flight = 0    # currently executing on a worker thread
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+
+class _DbQuery:
+    """Thin proxy around a postgrest query builder. Every chained call returns
+    another proxy; only `execute()` differs, and it is awaitable."""
+    __slots__ = ("_repo", "_table", "_builder")
+
+    def __init__(self, repo: "SupabaseRepository", table: str, builder):
+        self._repo = repo
+        self._table = table
+        self._builder = builder
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return _DbQuery(self._repo, self._table, attr)
+
+        def chained(*args, **kwargs):
+            return _DbQuery(self._repo, self._table, attr(*args, **kwargs))
+        return chained
+
+    async def execute(self):
+        return await self._repo.run(self._table, self._builder.execute)
+
+
+class SupabaseRepository:
+    def __init__(self, client: Client, max_workers: int, table_concurrency: int):
+        self.client = client
+        self.table_concurrency = table_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="supabase")
+        self.stats: dict[str, _TableStats] = {}
+        self._limits: dict[str, asyncio.Semaphore] = {}
+
+    def table(self, name: str) -> _DbQuery:
+        return _DbQuery(self, name, self.client.table(name))
+
+    async def run(self, table: str, fn):
+        stats = self.stats.get(table)
+        if stats is None:
+            stats = self.stats[table] = _TableStats()
+        limit = self._limits.get(table)
+        if limit is None:
+            limit = self._limits[table] = asyncio.Semaphore(self.table_concurrency)
+
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        stats.queued += 1
+        waiting = True
+        try:
+            async with limit:
+                stats.queued -= 1
+                waiting = False
+                stats.in_flight += 1
+                try:
+                    return await loop.run_in_executor(self.executor, fn)
+                finally:
+                    stats.in_flight -= 1
+        except BaseException:
+            stats.errors += 1
+            raise
+        finally:
+            if waiting:
+                stats.queued -= 1
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            stats.calls += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+
+    def summary(self) -> dict:
+        calls = sum(s.calls for s in self.stats.values())
+        total_ms = sum(s.total_ms for s in self.stats.values())
+        return {
+            "calls": calls,
+            "errors": sum(s.errors for s in self.stats.values()),
+            "queued": sum(s.queued for s in self.stats.values()),
+            "in_flight": sum(s.in_flight for s in self.stats.values()),
+            "avg_ms": total_ms / calls if calls else 0.0,
+            "max_ms": max((s.max_ms for s in self.stats.values()), default=0.0),
+        }
+
+
+db = SupabaseRepository(supabase, DB_MAX_WORKERS, DB_TABLE_CONCURRENCY)
+
 # ------------------------------------------------------------------
 # BOT SETUP
 # ------------------------------------------------------------------
@@ -103,6 +234,104 @@ bot = commands.AutoShardedBot(
 bot.start_time = time.time()
 bot.commands_executed = 0
 
+# ------------------------------------------------------------------
+# HTTP CLIENT
+# ------------------------------------------------------------------
+# One pooled aiohttp session for all outbound HTTP (OpenRouter, status probes),
+# so keep-alive connections and cached DNS are reused instead of paying a TCP +
+# TLS handshake per call. Created in setup_hook, closed in close_bot.
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_DNS_TTL = 300
+HTTP_KEEPALIVE_SECONDS = 60
+
+
+class _HttpPoolStats:
+    __slots__ = ("requests", "in_flight", "errors", "connections_created", "connections_reused", "dns_hits", "dns_misses")
+
+    def __init__(self):
+        self.requests = self.in_flight = self.errors = 0
+        self.connections_created = self.connections_reused = 0
+        self.dns_hits = self.dns_misses = 0
+
+    def summary(self) -> str:
+        return (f"{self.in_flight} in flight / {self.requests} requests ({self.errors} errors)\n"
+                f"conns {self.connections_created} new / {self.connections_reused} reused\n"
+                f"dns {self.dns_hits} hits / {self.dns_misses} misses")
+
+
+class _CountedResponse(aiohttp.ClientResponse):
+    """Stays in flight until released or closed, not just until its headers
+    arrive, so a streamed body being read still counts."""
+    _counted = False
+
+    def _settle(self):
+        if self._counted:
+            self._counted = False
+            bot.http_stats.in_flight -= 1
+
+    def release(self):
+        self._settle()
+        return super().release()
+
+    def close(self):
+        self._settle()
+        super().close()
+
+
+def _http_trace_config(stats: _HttpPoolStats) -> aiohttp.TraceConfig:
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        stats.requests += 1
+        stats.in_flight += 1
+
+    async def on_request_end(session, ctx, params):
+        params.response._counted = True  # in_flight drops when the response is released
+
+    async def on_request_exception(session, ctx, params):
+        stats.in_flight -= 1
+        stats.errors += 1
+
+    async def on_connection_create_end(session, ctx, params):
+        stats.connections_created += 1
+
+    async def on_connection_reuseconn(session, ctx, params):
+        stats.connections_reused += 1
+
+    async def on_dns_cache_hit(session, ctx, params):
+        stats.dns_hits += 1
+
+    async def on_dns_cache_miss(session, ctx, params):
+        stats.dns_misses += 1
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_exception)
+    trace.on_connection_create_end.append(on_connection_create_end)
+    trace.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace.on_dns_cache_hit.append(on_dns_cache_hit)
+    trace.on_dns_cache_miss.append(on_dns_cache_miss)
+    return trace
+
+
+bot.http_stats = _HttpPoolStats()
+bot.http_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """The shared session; created on first use if setup_hook hasn't run yet."""
+    if bot.http_session is None or bot.http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+        )
+        bot.http_session = aiohttp.ClientSession(connector=connector, response_class=_CountedResponse,
+                                                 trace_configs=[_http_trace_config(bot.http_stats)])
+    return bot.http_session
+
 # ------------------------------------------------------------------
 # CACHE LAYER
 # ------------------------------------------------------------------
@@ -112,37 +341,253 @@ bot.commands_executed = 0
 # configured, everything falls back to plain in-memory dicts (fine for a
 # single-process deployment).
 bot.redis = aioredis.from_url(REDIS_URL, decode_responses=True) if (REDIS_URL and aioredis) else None
+# cache_* values are serialized per namespace (possibly to binary), so they go
+# through a second client that hands back raw bytes.
+bot.redis_raw = aioredis.from_url(REDIS_URL) if bot.redis else None
 
 # in-memory fallback caches (used directly when bot.redis is None)
 bot.guild_config_cache: dict[int, dict] = {}
-bot.antinuke_actions: dict[int, dict] = {}   # guild_id -> {actor_id: [timestamps]}
 bot.afk_cache: dict[tuple, dict] = {}         # (guild_id, user_id) -> {"reason":..., "time":...}
 bot.ai_context: dict[int, list] = {}          # user_id -> list of {"role","content"}
-bot.invite_cache: dict[int, dict] = {}        # guild_id -> {invite_code: uses}
+bot.invite_cache: dict[int, dict] = {}        # guild_id -> {"fetched_at", "uses": {invite_code: uses}}
 bot.xp_cooldowns: dict[str, float] = {}       # "guild_id:user_id" -> last XP award timestamp
 
 
+# Serializer per namespace: (dumps, loads). orjson output is plain JSON, so it
+# can be switched on or off without invalidating existing keys; msgpack is
+# smaller but binary, so only pick it for a namespace once every process has
+# msgpack installed. Anything unavailable falls back to stdlib json.
+CACHE_SERIALIZERS = {
+    "json": (json.dumps, json.loads),
+}
+if orjson:
+    CACHE_SERIALIZERS["orjson"] = (lambda v: orjson.dumps(v, option=orjson.OPT_NON_STR_KEYS), orjson.loads)
+if msgpack:
+    CACHE_SERIALIZERS["msgpack"] = (msgpack.packb, lambda raw: msgpack.unpackb(raw, strict_map_key=False))
+
+CACHE_NAMESPACE_SERIALIZER = {
+    "guild_config_cache": "orjson",
+    "afk_cache": "orjson",
+    "invite_cache": "orjson",
+    "xp_cooldowns": "orjson",
+    "ai_response_cache": "orjson",
+}
+
+
+def _serializer(namespace: str):
+    return CACHE_SERIALIZERS.get(CACHE_NAMESPACE_SERIALIZER.get(namespace, "json"), CACHE_SERIALIZERS["json"])
+
+
 async def cache_get(namespace: str, key, default=None):
     """Read from Redis if configured, else from the in-memory dict named `namespace`."""
     if bot.redis:
-        raw = await bot.redis.get(f"{namespace}:{key}")
-        return json.loads(raw) if raw is not None else default
+        raw = await bot.redis_raw.get(f"{namespace}:{key}")
+        return _serializer(namespace)[1](raw) if raw is not None else default
     return getattr(bot, namespace).get(key, default)
 
 
+async def cache_get_many(namespace: str, keys: list, default=None) -> list:
+    """Like cache_get for several keys at once: a single MGET with Redis."""
+    if not keys:
+        return []
+    if bot.redis:
+        loads = _serializer(namespace)[1]
+        raws = await bot.redis_raw.mget([f"{namespace}:{key}" for key in keys])
+        return [loads(raw) if raw is not None else default for raw in raws]
+    store = getattr(bot, namespace)
+    return [store.get(key, default) for key in keys]
+
+
 async def cache_set(namespace: str, key, value, ttl: Optional[int] = None):
     if bot.redis:
-        await bot.redis.set(f"{namespace}:{key}", json.dumps(value), ex=ttl)
+        await bot.redis_raw.set(f"{namespace}:{key}", _serializer(namespace)[0](value), ex=ttl)
     else:
         getattr(bot, namespace)[key] = value
 
 
+async def cache_set_many(namespace: str, mapping: dict, ttl: Optional[int] = None):
+    """Like cache_set for several keys at once: one pipelined round-trip with Redis."""
+    if not mapping:
+        return
+    if bot.redis:
+        dumps = _serializer(namespace)[0]
+        pipe = bot.redis_raw.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(f"{namespace}:{key}", dumps(value), ex=ttl)
+        await pipe.execute()
+    else:
+        getattr(bot, namespace).update(mapping)
+
+
 async def cache_delete(namespace: str, key):
     if bot.redis:
-        await bot.redis.delete(f"{namespace}:{key}")
+        await bot.redis_raw.delete(f"{namespace}:{key}")
     else:
         getattr(bot, namespace).pop(key, None)
 
+
+class LocalLRUCache:
+    """Process-local LRU with per-entry TTL, used as a first tier in front of
+    Redis for hot, rarely-changing values."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        rate = 100 * self.hits / lookups if lookups else 0.0
+        return f"{rate:.1f}% hit ({self.hits}/{lookups}), {self.evictions} evicted"
+
+
+# Sliding-window rate counter. With Redis, each key is a sorted set of event
+# timestamps and one Lua script trims, adds, counts and (optionally) resets it
+# atomically in a single round-trip, so concurrent events from several
+# processes can't lose increments. Without Redis the same semantics run on
+# per-key deques; there is no await between read and write, so it is atomic
+# on the event loop without any locking.
+SLIDING_WINDOW_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local window = tonumber(ARGV[1])
+local count = tonumber(ARGV[2])
+local trip_at = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+for i = 1, count do
+    redis.call('ZADD', KEYS[1], now, ARGV[4] .. ':' .. i)
+end
+local total = redis.call('ZCARD', KEYS[1])
+if trip_at > 0 and total >= trip_at then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('EXPIRE', KEYS[1], math.ceil(window) + 5)
+end
+return total
+"""
+
+
+class SlidingWindowCounter:
+    SWEEP_EVERY = 1024  # in-memory mode: drop idle keys every N hits
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._local: dict[str, deque] = {}
+        self._windows: dict[str, float] = {}
+        self._hits = 0
+        self._seq = 0
+        self._script = None
+
+    async def hit(self, key, window: float, count: int = 1, trip_at: int = 0) -> int:
+        """Record `count` events for `key` and return how many fall inside the
+        last `window` seconds. If that reaches `trip_at` (> 0) the key is
+        cleared in the same step, so exactly one caller observes the trip."""
+        if bot.redis:
+            if self._script is None:
+                self._script = bot.redis.register_script(SLIDING_WINDOW_LUA)
+            self._seq += 1
+            nonce = f"{PROCESS_ID}:{self._seq}"
+            return int(await self._script(keys=[f"{self.namespace}:{key}"], args=[window, count, trip_at, nonce]))
+
+        now = time.time()
+        events = self._local.get(key)
+        if events is None:
+            events = self._local[key] = deque()
+        self._windows[key] = window
+        events.extend([now] * count)
+        while events and events[0] <= now - window:
+            events.popleft()
+        total = len(events)
+        if trip_at and total >= trip_at:
+            events.clear()
+
+        self._hits += 1
+        if self._hits % self.SWEEP_EVERY == 0:
+            self._sweep(now)
+        return total
+
+    def _sweep(self, now: float):
+        for key in [k for k, ev in self._local.items() if not ev or ev[-1] <= now - self._windows[k]]:
+            del self._local[key]
+            del self._windows[key]
+
+
+# Process-local derived caches (compiled matchers, indexes, ...) can't live in
+# Redis, so when one process changes the underlying rows it broadcasts an
+# invalidation over Redis pub/sub and every other process drops its copy.
+# Handlers are plain functions taking the payload; a payload of None means
+# "drop everything" (sent to ourselves after a pub/sub reconnect, since any
+# invalidations published while we were disconnected were lost).
+INVALIDATION_CHANNEL = "vantix:invalidate"
+PROCESS_ID = uuid.uuid4().hex
+bot.invalidation_handlers: dict[str, Callable] = {}
+bot.invalidation_task: Optional[asyncio.Task] = None
+
+
+def on_invalidate(kind: str):
+    def decorator(fn):
+        bot.invalidation_handlers[kind] = fn
+        return fn
+    return decorator
+
+
+async def publish_invalidation(kind: str, payload=None):
+    """Apply an invalidation locally, then broadcast it to the other processes."""
+    bot.invalidation_handlers[kind](payload)
+    if bot.redis:
+        try:
+            await bot.redis.publish(INVALIDATION_CHANNEL, json.dumps({"origin": PROCESS_ID, "kind": kind, "payload": payload}))
+        except Exception as e:
+            logger.error(f"publish_invalidation error: {e}")
+
+
+async def invalidation_listener():
+    while True:
+        try:
+            pubsub = bot.redis.pubsub()
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            for handler in bot.invalidation_handlers.values():
+                handler(None)
+            async for msg in pubsub.listen():
+                if msg["type"] != "message":
+                    continue
+                data = json.loads(msg["data"])
+                handler = bot.invalidation_handlers.get(data["kind"])
+                if handler and data["origin"] != PROCESS_ID:
+                    handler(data["payload"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"invalidation_listener error: {e}")
+            await asyncio.sleep(5)
+
 # ------------------------------------------------------------------
 # HELPERS
 # ------------------------------------------------------------------
@@ -176,12 +621,180 @@ def parse_duration(duration_str: str) -> Optional[int]:
     return amount * multipliers[unit]
 
 
+async def single_flight(in_flight: dict, key, coro_factory):
+    """Run `coro_factory()` once per key; concurrent callers share the result."""
+    task = in_flight.get(key)
+    if task is None:
+        task = in_flight[key] = asyncio.ensure_future(coro_factory())
+        task.add_done_callback(lambda t: in_flight.pop(key) if in_flight.get(key) is t else None)
+    return await asyncio.shield(task)
+
+
+# A load racing an invalidation must not store rows it read before the change.
+# Invalidations bump a per-key generation (key None: everything) and forget the
+# pending load; a loader snapshots the generation before querying and only
+# stores its result if it is still current.
+def bump_generation(generations: dict, key):
+    generations[key] = generations.get(key, 0) + 1
+
+
+def current_generation(generations: dict, key) -> tuple[int, int]:
+    return generations.get(None, 0), generations.get(key, 0)
+
+
+async def select_all(build: Callable, page: int = 1000) -> list[dict]:
+    """Pages through a query with .range(); `build()` must return a fresh,
+    deterministically ordered query each time."""
+    rows, start = [], 0
+    while True:
+        res = await build().range(start, start + page - 1).execute()
+        rows.extend(res.data)
+        if len(res.data) < page:
+            return rows
+        start += page
+
+
+# Discord throttles some edits hard (channel renames: ~2 per 10 minutes). The
+# scheduler keeps only the newest pending edit per key: the first submit runs
+# at once, anything submitted during the following `interval` collapses into a
+# single edit at the end of it. Callers never wait on Discord; edit functions
+# should read the current state when they run so the newest value wins.
+class CoalescingEditor:
+    def __init__(self, name: str):
+        self.name = name
+        self.pending: dict = {}  # key -> async edit function
+        self.workers: dict = {}
+        self.applied = 0
+        self.coalesced = 0
+
+    def submit(self, key, edit: Callable, interval: float):
+        if key in self.pending:
+            self.coalesced += 1
+        self.pending[key] = edit
+        if key not in self.workers:
+            self.workers[key] = asyncio.create_task(self._run(key, interval))
+
+    async def _run(self, key, interval: float):
+        try:
+            while key in self.pending:
+                edit = self.pending.pop(key)
+                try:
+                    await edit()
+                    self.applied += 1
+                except Exception as e:
+                    logger.error(f"{self.name} edit error: {e}")
+                await asyncio.sleep(interval)
+        finally:
+            self.workers.pop(key, None)
+
+
+channel_editor = CoalescingEditor("channel")
+
+
+# Per-scope (usually per-guild) leaderboard: a member -> score dict next to a
+# list of (-score, member) kept sorted, so a rank lookup is one bisect, a page
+# is a slice and an update moves a single entry. Scopes are loaded lazily via
+# `loader(scope) -> {member: score}`; least recently used scopes are dropped and
+# simply reloaded later. Updates carry absolute scores, written by the shard
+# that owns the guild after the backing rows are persisted, so updates racing a
+# load are buffered and replayed on top of it. Scores <= 0 are not ranked.
+RANKED_INDEX_MAX_SCOPES = 1000
+
+
+class RankedIndex:
+    def __init__(self, loader: Callable, max_scopes: int = RANKED_INDEX_MAX_SCOPES):
+        self.loader = loader
+        self.max_scopes = max_scopes
+        self.scopes: OrderedDict = OrderedDict()  # scope -> (scores, order)
+        self.loading: dict = {}
+        self.early: dict = {}  # scope -> {member: score} seen while loading
+
+    async def _load(self, scope):
+        self.early[scope] = {}
+        try:
+            scores = {m: s for m, s in (await self.loader(scope)).items() if s > 0}
+            entry = (scores, sorted((-s, m) for m, s in scores.items()))
+            for member, score in self.early[scope].items():
+                self._apply(entry, member, score)
+        finally:
+            self.early.pop(scope, None)
+        self.scopes[scope] = entry
+        while len(self.scopes) > self.max_scopes:
+            self.scopes.popitem(last=False)
+        return entry
+
+    async def _scope(self, scope):
+        entry = self.scopes.get(scope)
+        if entry is None:
+            return await single_flight(self.loading, scope, lambda: self._load(scope))
+        self.scopes.move_to_end(scope)
+        return entry
+
+    @staticmethod
+    def _apply(entry, member, score):
+        scores, order = entry
+        old = scores.pop(member, None)
+        if old is not None:
+            del order[bisect.bisect_left(order, (-old, member))]
+        if score > 0:
+            scores[member] = score
+            bisect.insort(order, (-score, member))
+
+    def update(self, scope, member, score):
+        """Record `member`'s new absolute score; a no-op for scopes not in memory."""
+        if scope in self.scopes:
+            self._apply(self.scopes[scope], member, score)
+        elif scope in self.early:
+            self.early[scope][member] = score
+
+    def in_top(self, scope, member, n: int) -> bool:
+        """Whether `member` currently ranks within the top n. Assumes yes for
+        scopes not in memory, so callers err on the side of invalidating."""
+        entry = self.scopes.get(scope)
+        if entry is None:
+            return True
+        score = entry[0].get(member)
+        return score is not None and bisect.bisect_left(entry[1], (-score, member)) < n
+
+    async def rank(self, scope, member) -> Optional[tuple[int, int]]:
+        """1-based (rank, ranked members), or None if the member isn't ranked."""
+        scores, order = await self._scope(scope)
+        score = scores.get(member)
+        if score is None:
+            return None
+        return bisect.bisect_left(order, (-score, member)) + 1, len(order)
+
+    async def page(self, scope, start: int, count: int) -> tuple[list[tuple], int]:
+        """(member, score) pairs for ranks start+1 .. start+count, and the total."""
+        scores, order = await self._scope(scope)
+        return [(m, -s) for s, m in order[start:start + count]], len(order)
+
+
+# Config is read several times per message but changes only through
+# update_guild_config, which broadcasts an invalidation. The local TTL is just
+# a safety net for a missed pub/sub message.
+GUILD_CONFIG_LOCAL_TTL = 60
+bot.guild_config_local = LocalLRUCache(max_size=10_000, ttl=GUILD_CONFIG_LOCAL_TTL)
+
+
+@on_invalidate("guild_config")
+def _invalidate_guild_config(guild_id: Optional[int]):
+    if guild_id is None:
+        bot.guild_config_local.clear()
+    else:
+        bot.guild_config_local.delete(guild_id)
+
+
 async def get_guild_config(guild_id: int) -> dict:
+    cfg = bot.guild_config_local.get(guild_id)
+    if cfg is not None:
+        return cfg
     cached = await cache_get("guild_config_cache", guild_id)
     if cached is not None:
+        bot.guild_config_local.set(guild_id, cached)
         return cached
     try:
-        res = supabase.table("guild_config").select("*").eq("guild_id", guild_id).execute()
+        res = await db.table("guild_config").select("*").eq("guild_id", guild_id).execute()
         if res.data:
             cfg = res.data[0]
         else:
@@ -192,8 +805,9 @@ async def get_guild_config(guild_id: int) -> dict:
                    "ticket_category_id": None, "ticket_staff_role": None, "ticket_log_channel": None,
                    "badwords_log_channel": None, "membercount_channel": None,
                    "premium": False}
-            supabase.table("guild_config").insert(cfg).execute()
+            await db.table("guild_config").insert(cfg).execute()
         await cache_set("guild_config_cache", guild_id, cfg, ttl=300)
+        bot.guild_config_local.set(guild_id, cfg)
         return cfg
     except Exception as e:
         logger.error(f"get_guild_config error: {e}")
@@ -204,8 +818,10 @@ async def update_guild_config(guild_id: int, **fields):
     cfg = await get_guild_config(guild_id)
     cfg.update(fields)
     await cache_set("guild_config_cache", guild_id, cfg, ttl=300)
+    await publish_invalidation("guild_config", guild_id)
+    bot.guild_config_local.set(guild_id, cfg)
     try:
-        supabase.table("guild_config").update(fields).eq("guild_id", guild_id).execute()
+        await db.table("guild_config").update(fields).eq("guild_id", guild_id).execute()
     except Exception as e:
         logger.error(f"update_guild_config error: {e}")
 
@@ -292,34 +908,30 @@ async def on_command_error(ctx, error):
 # 1. ANTI-NUKE SYSTEM
 # ==================================================================
 
-async def antinuke_check(guild: discord.Guild, actor: discord.abc.User, action: str):
+antinuke_counter = SlidingWindowCounter("antinuke_actions")
+
+
+async def antinuke_check(guild: discord.Guild, actor: discord.abc.User, action: str, count: int = 1):
     cfg = await get_guild_config(guild.id)
     if not cfg.get("antinuke_enabled"):
         return
 
     # whitelist check
     try:
-        wl = supabase.table("antinuke_whitelist").select("*").eq("guild_id", guild.id).eq("user_id", actor.id).execute()
+        wl = await db.table("antinuke_whitelist").select("*").eq("guild_id", guild.id).eq("user_id", actor.id).execute()
         if wl.data:
             return
     except Exception as e:
         logger.error(f"antinuke whitelist check error: {e}")
 
-    now = time.time()
     window = cfg.get("antinuke_window", 10)
     threshold = cfg.get("antinuke_threshold", 5)
 
-    bucket_key = f"{guild.id}:{actor.id}"
-    actor_events = await cache_get("antinuke_actions", bucket_key, default=[])
-    actor_events.append(now)
-    actor_events = [t for t in actor_events if now - t <= window]
-
-    if len(actor_events) < threshold:
-        await cache_set("antinuke_actions", bucket_key, actor_events, ttl=window + 5)
+    # trip_at resets the window atomically with the trigger
+    hits = await antinuke_counter.hit(f"{guild.id}:{actor.id}", window, count, trip_at=threshold)
+    if hits < threshold:
         return
 
-    await cache_delete("antinuke_actions", bucket_key)  # reset after trigger
-
     punishment = "none"
     member = guild.get_member(actor.id)
     try:
@@ -338,7 +950,7 @@ async def antinuke_check(guild: discord.Guild, actor: discord.abc.User, action:
         punishment = "failed (error)"
 
     try:
-        supabase.table("antinuke_logs").insert({
+        await db.table("antinuke_logs").insert({
             "guild_id": guild.id, "actor_id": actor.id, "action": action,
             "punishment": punishment, "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
         }).execute()
@@ -352,42 +964,98 @@ async def antinuke_check(guild: discord.Guild, actor: discord.abc.User, action:
     await log_to_channel(guild, cfg.get("antinuke_log_channel") or cfg.get("modlog_channel"), embed)
 
 
+# A nuke fires hundreds of delete/ban events within seconds. Instead of one
+# audit_logs(limit=1) request per event (which burns the rate limit and, with
+# several moderators acting at once, blames whoever acted last), events are
+# queued per (guild, audit action) and drained after a short debounce with a
+# single larger audit-log fetch. Entries are matched back to events by target
+# ID and every matched actor is fed to antinuke_check once, with its count.
+AUDIT_DEBOUNCE_SECONDS = 1.5
+AUDIT_FETCH_LIMIT = 100
+AUDIT_MATCH_SLACK_SECONDS = 5  # how old an entry may be relative to its event
+
+
+class AuditLogCoalescer:
+    def __init__(self, debounce: float):
+        self.debounce = debounce
+        self.pending: dict[tuple[int, discord.AuditLogAction], list[tuple[Optional[int], float]]] = {}
+        self.drains: dict[tuple[int, discord.AuditLogAction], asyncio.Task] = {}
+        self.seen: OrderedDict[int, None] = OrderedDict()  # audit entry IDs already attributed
+
+    def report(self, guild: discord.Guild, action: discord.AuditLogAction, label: str, target_id: Optional[int]):
+        """Queue an event; `target_id` None means "match by time" (e.g. webhooks)."""
+        key = (guild.id, action)
+        self.pending.setdefault(key, []).append((target_id, time.time()))
+        if key not in self.drains:
+            self.drains[key] = asyncio.create_task(self._drain(guild, action, label))
+
+    async def _drain(self, guild: discord.Guild, action: discord.AuditLogAction, label: str):
+        key = (guild.id, action)
+        await asyncio.sleep(self.debounce)
+        events = self.pending.pop(key, [])
+        self.drains.pop(key, None)
+        try:
+            cfg = await get_guild_config(guild.id)
+            if not cfg.get("antinuke_enabled") or not events:
+                return
+            limit = min(AUDIT_FETCH_LIMIT, max(10, 2 * len(events)))
+            entries = [e async for e in guild.audit_logs(limit=limit, action=action)]
+        except discord.Forbidden:
+            return
+        except Exception as e:
+            logger.error(f"audit log fetch error: {e}")
+            return
+
+        actors: dict[int, list] = {}  # actor_id -> [user, count]
+        for target_id, reported_at in events:
+            for entry in entries:
+                if entry.id in self.seen or entry.user is None:
+                    continue
+                if entry.created_at.timestamp() < reported_at - AUDIT_MATCH_SLACK_SECONDS:
+                    continue
+                if target_id is not None and (entry.target is None or entry.target.id != target_id):
+                    continue
+                self.seen[entry.id] = None
+                actors.setdefault(entry.user.id, [entry.user, 0])[1] += 1
+                break
+        while len(self.seen) > 10_000:
+            self.seen.popitem(last=False)
+
+        for actor, count in actors.values():
+            try:
+                await antinuke_check(guild, actor, label, count=count)
+            except Exception as e:
+                logger.error(f"antinuke_check error: {e}")
+
+
+audit_reader = AuditLogCoalescer(AUDIT_DEBOUNCE_SECONDS)
+
+
 @bot.event
 async def on_guild_channel_delete(channel):
-    async for entry in channel.guild.audit_logs(limit=1, action=discord.AuditLogAction.channel_delete):
-        await antinuke_check(channel.guild, entry.user, "mass_channel_delete")
-        break
+    audit_reader.report(channel.guild, discord.AuditLogAction.channel_delete, "mass_channel_delete", channel.id)
 
 
 @bot.event
 async def on_guild_role_delete(role):
-    async for entry in role.guild.audit_logs(limit=1, action=discord.AuditLogAction.role_delete):
-        await antinuke_check(role.guild, entry.user, "mass_role_delete")
-        break
+    audit_reader.report(role.guild, discord.AuditLogAction.role_delete, "mass_role_delete", role.id)
 
 
 @bot.event
 async def on_member_ban(guild, user):
-    async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.ban):
-        await antinuke_check(guild, entry.user, "mass_ban")
-        break
+    audit_reader.report(guild, discord.AuditLogAction.ban, "mass_ban", user.id)
 
 
 @bot.event
 async def on_member_remove(member):
     # Distinguish kicks via audit log (also handled by invite tracking below)
-    async for entry in member.guild.audit_logs(limit=1, action=discord.AuditLogAction.kick):
-        if entry.target and entry.target.id == member.id and (time.time() - entry.created_at.timestamp()) < 5:
-            await antinuke_check(member.guild, entry.user, "mass_kick")
-        break
+    audit_reader.report(member.guild, discord.AuditLogAction.kick, "mass_kick", member.id)
     await handle_invite_leave(member)
 
 
 @bot.event
 async def on_webhooks_update(channel):
-    async for entry in channel.guild.audit_logs(limit=1, action=discord.AuditLogAction.webhook_create):
-        await antinuke_check(channel.guild, entry.user, "webhook_spam")
-        break
+    audit_reader.report(channel.guild, discord.AuditLogAction.webhook_create, "webhook_spam", None)
 
 
 @bot.event
@@ -395,9 +1063,7 @@ async def on_member_update(before, after):
     if before.roles != after.roles:
         added = [r for r in after.roles if r not in before.roles]
         if any(r.permissions.administrator for r in added):
-            async for entry in after.guild.audit_logs(limit=1, action=discord.AuditLogAction.member_role_update):
-                await antinuke_check(after.guild, entry.user, "dangerous_permission_grant")
-                break
+            audit_reader.report(after.guild, discord.AuditLogAction.member_role_update, "dangerous_permission_grant", after.id)
 
 
 antinuke_group = app_commands.Group(name="antinuke", description="Anti-nuke configuration")
@@ -427,10 +1093,10 @@ async def antinuke_threshold(interaction: discord.Interaction, actions: int, win
 @antinuke_group.command(name="whitelist", description="Whitelist a trusted user/bot")
 @has_admin_perms()
 async def antinuke_whitelist(interaction: discord.Interaction, user: discord.User):
-    existing = supabase.table("antinuke_whitelist").select("id").eq("guild_id", interaction.guild_id).eq("user_id", user.id).execute()
+    existing = await db.table("antinuke_whitelist").select("id").eq("guild_id", interaction.guild_id).eq("user_id", user.id).execute()
     if existing.data:
         return await interaction.response.send_message(embed=make_embed("🛡️ Anti-Nuke", f"{user.mention} is already whitelisted.", discord.Color.orange(), bot.user), ephemeral=True)
-    supabase.table("antinuke_whitelist").upsert({"guild_id": interaction.guild_id, "user_id": user.id}, on_conflict="guild_id,user_id").execute()
+    await db.table("antinuke_whitelist").upsert({"guild_id": interaction.guild_id, "user_id": user.id}, on_conflict="guild_id,user_id").execute()
     await interaction.response.send_message(embed=make_embed("🛡️ Anti-Nuke", f"{user.mention} whitelisted.", discord.Color.green(), bot.user))
 
 
@@ -447,27 +1113,110 @@ bot.tree.add_command(antinuke_group)
 # 2. BADWORDS SYSTEM
 # ==================================================================
 
+class BadwordMatcher:
+    """Aho-Corasick automaton over one guild's filtered words. Built once per
+    word-list change; `search` is a single pass over the message, regardless
+    of how many words the guild filters."""
+    __slots__ = ("words", "_goto", "_fail", "_out")
+
+    def __init__(self, words):
+        self.words = frozenset(w for w in words if w)
+        goto: list[dict[str, int]] = [{}]
+        out = [False]
+        for word in self.words:
+            node = 0
+            for ch in word:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    out.append(False)
+                node = nxt
+            out[node] = True
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[child] = goto[f].get(ch, 0) if node else 0
+                out[child] = out[child] or out[fail[child]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def search(self, text: str) -> bool:
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                return True
+        return False
+
+
+bot.badword_matchers: dict[int, BadwordMatcher] = {}  # guild_id -> compiled matcher
+bot.badword_loading: dict[int, asyncio.Task] = {}
+bot.badword_generations: dict[Optional[int], int] = {}
+
+
+@on_invalidate("badwords")
+def _invalidate_badwords(guild_id: Optional[int]):
+    bump_generation(bot.badword_generations, guild_id)
+    if guild_id is None:
+        bot.badword_matchers.clear()
+        bot.badword_loading.clear()
+    else:
+        bot.badword_matchers.pop(guild_id, None)
+        bot.badword_loading.pop(guild_id, None)
+
+
+async def get_badword_matcher(guild_id: int) -> BadwordMatcher:
+    matcher = bot.badword_matchers.get(guild_id)
+    if matcher is not None:
+        return matcher
+
+    async def load():
+        generation = current_generation(bot.badword_generations, guild_id)
+        rows = await select_all(lambda: db.table("badwords").select("word").eq("guild_id", guild_id).order("word"))
+        compiled = BadwordMatcher(r["word"] for r in rows)
+        if current_generation(bot.badword_generations, guild_id) == generation:
+            bot.badword_matchers[guild_id] = compiled
+        return compiled
+    return await single_flight(bot.badword_loading, guild_id, load)
+
+
 badwords_group = app_commands.Group(name="badwords", description="Manage the badword filter")
 
 
 @badwords_group.command(name="add", description="Add a badword to the filter")
 @has_mod_perms()
 async def badwords_add(interaction: discord.Interaction, word: str):
-    supabase.table("badwords").insert({"guild_id": interaction.guild_id, "word": word.lower()}).execute()
+    await db.table("badwords").insert({"guild_id": interaction.guild_id, "word": word.lower()}).execute()
+    await publish_invalidation("badwords", interaction.guild_id)
     await interaction.response.send_message(embed=make_embed("🚫 Badwords", f"Added `{word}` to the filter.", discord.Color.green(), bot.user), ephemeral=True)
 
 
 @badwords_group.command(name="remove", description="Remove a badword from the filter")
 @has_mod_perms()
 async def badwords_remove(interaction: discord.Interaction, word: str):
-    supabase.table("badwords").delete().eq("guild_id", interaction.guild_id).eq("word", word.lower()).execute()
+    await db.table("badwords").delete().eq("guild_id", interaction.guild_id).eq("word", word.lower()).execute()
+    await publish_invalidation("badwords", interaction.guild_id)
     await interaction.response.send_message(embed=make_embed("🚫 Badwords", f"Removed `{word}` from the filter.", discord.Color.green(), bot.user), ephemeral=True)
 
 
 @badwords_group.command(name="list", description="List all filtered badwords")
 @has_mod_perms()
 async def badwords_list(interaction: discord.Interaction):
-    res = supabase.table("badwords").select("word").eq("guild_id", interaction.guild_id).execute()
+    res = await db.table("badwords").select("word").eq("guild_id", interaction.guild_id).execute()
     words = ", ".join(f"`{r['word']}`" for r in res.data) or "None configured."
     await interaction.response.send_message(embed=make_embed("🚫 Badwords List", words, discord.Color.blurple(), bot.user), ephemeral=True)
 
@@ -475,52 +1224,118 @@ async def badwords_list(interaction: discord.Interaction):
 bot.tree.add_command(badwords_group)
 
 
+# Per-message features, resolved once from the guild config. Stages whose bit
+# is clear are never awaited.
+FEATURE_BADWORDS = 1 << 0
+FEATURE_ANTISPAM = 1 << 1
+FEATURE_CUSTOM_COMMANDS = 1 << 2
+
+
+def guild_features(cfg: dict) -> int:
+    features = 0
+    if cfg.get("automode_enabled", True):
+        matcher = bot.badword_matchers.get(cfg.get("guild_id"))
+        if matcher is None or matcher.words:
+            features |= FEATURE_BADWORDS
+    if cfg.get("antispam_enabled"):
+        features |= FEATURE_ANTISPAM
+    if bot.custom_command_index.get(cfg.get("guild_id"), True):  # unknown (not loaded yet) or non-empty
+        features |= FEATURE_CUSTOM_COMMANDS
+    return features
+
+
+class _StageStats:
+    __slots__ = ("calls", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+
+class MessagePipeline:
+    """Runs every on_message stage with one guild-config lookup. Moderation runs
+    first and ends the pipeline once the message is deleted or its author
+    punished; the remaining, independent stages then run concurrently."""
+
+    def __init__(self):
+        self.stats: dict[str, _StageStats] = {}
+
+    async def _timed(self, stage: str, coro):
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            stats = self.stats.get(stage)
+            if stats is None:
+                stats = self.stats[stage] = _StageStats()
+            stats.calls += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+
+    async def run(self, message: discord.Message):
+        cfg = await self._timed("config", get_guild_config(message.guild.id))
+        features = guild_features(cfg)
+        if message.author.guild_permissions.manage_messages:
+            features &= ~(FEATURE_BADWORDS | FEATURE_ANTISPAM)
+
+        if features & FEATURE_BADWORDS and await self._timed("badwords", handle_badwords(message, cfg)):
+            return
+        if features & FEATURE_ANTISPAM and await self._timed("antispam", handle_antispam(message, cfg)):
+            return
+
+        stages = [self._timed("afk", handle_afk(message)), self._timed("xp", add_xp(message))]
+        if features & FEATURE_CUSTOM_COMMANDS and message.content.startswith(cfg.get("prefix", "!")):
+            stages.append(self._timed("custom_command", handle_custom_command(message, cfg)))
+        for result in await asyncio.gather(*stages, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"message pipeline stage error: {result}")
+
+    def summary(self) -> str:
+        return "\n".join(f"{stage}: {s.total_ms / s.calls:.1f}ms avg" for stage, s in self.stats.items() if s.calls) or "No messages yet."
+
+
+bot.message_pipeline = MessagePipeline()
+
+
 @bot.event
 async def on_message(message: discord.Message):
     if message.author.bot or not message.guild:
         await bot.process_commands(message)
         return
 
-    await handle_afk(message)
-    await handle_custom_command(message)
-    await handle_badwords(message)
-    await handle_antispam(message)
-    await add_xp(message)
+    await bot.message_pipeline.run(message)
 
     await bot.process_commands(message)
 
 
-async def handle_badwords(message: discord.Message):
-    cfg = await get_guild_config(message.guild.id)
-    if not cfg.get("automode_enabled", True):
-        return
-    if message.author.guild_permissions.manage_messages:
-        return
+async def handle_badwords(message: discord.Message, cfg: dict) -> bool:
+    """Returns True if the message was deleted."""
     try:
-        res = supabase.table("badwords").select("word").eq("guild_id", message.guild.id).execute()
-        badwords = {r["word"] for r in res.data}
+        matcher = await get_badword_matcher(message.guild.id)
     except Exception as e:
         logger.error(f"badwords fetch error: {e}")
-        return
-    if not badwords:
-        return
+        return False
+    if not matcher.words:
+        return False
 
-    content_lower = message.content.lower()
-    if any(bw in content_lower for bw in badwords):
+    if matcher.search(message.content.lower()):
         try:
             await message.delete()
         except discord.Forbidden:
-            return
+            return False
 
         # escalation: warn the user automatically
         await add_warn(message.guild, message.author, bot.user, "Automatic warn: used a filtered word")
 
-        cfg = await get_guild_config(message.guild.id)
         embed = make_embed("🚫 Badword Filtered", color=discord.Color.orange(), bot_user=bot.user)
         embed.add_field(name="User", value=f"{message.author} (`{message.author.id}`)", inline=True)
         embed.add_field(name="Channel", value=message.channel.mention, inline=True)
         embed.add_field(name="Content", value=message.content[:500], inline=False)
         await log_to_channel(message.guild, cfg.get("badwords_log_channel") or cfg.get("modlog_channel"), embed)
+        return True
+    return False
 
 
 # ==================================================================
@@ -660,12 +1475,12 @@ async def untimeout_cmd(interaction: discord.Interaction, member: discord.Member
 # ==================================================================
 
 async def add_warn(guild: discord.Guild, member: discord.abc.User, moderator: discord.abc.User, reason: str):
-    supabase.table("warns").insert({
+    await db.table("warns").insert({
         "guild_id": guild.id, "user_id": member.id, "moderator_id": moderator.id,
         "reason": reason, "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
     }).execute()
 
-    res = supabase.table("warns").select("id").eq("guild_id", guild.id).eq("user_id", member.id).execute()
+    res = await db.table("warns").select("id").eq("guild_id", guild.id).eq("user_id", member.id).execute()
     warn_count = len(res.data)
 
     # auto-punishment thresholds
@@ -699,17 +1514,17 @@ async def warn_add(interaction: discord.Interaction, member: discord.Member, rea
 @warn_group.command(name="remove", description="Remove a member's most recent warn")
 @has_mod_perms()
 async def warn_remove(interaction: discord.Interaction, member: discord.Member):
-    res = supabase.table("warns").select("id").eq("guild_id", interaction.guild_id).eq("user_id", member.id).order("created_at", desc=True).limit(1).execute()
+    res = await db.table("warns").select("id").eq("guild_id", interaction.guild_id).eq("user_id", member.id).order("created_at", desc=True).limit(1).execute()
     if not res.data:
         return await interaction.response.send_message(embed=make_embed("❌ Error", "This member has no warns.", discord.Color.red(), bot.user), ephemeral=True)
-    supabase.table("warns").delete().eq("id", res.data[0]["id"]).execute()
+    await db.table("warns").delete().eq("id", res.data[0]["id"]).execute()
     await interaction.response.send_message(embed=make_embed("✅ Warn Removed", f"Removed the most recent warn for {member.mention}.", discord.Color.green(), bot.user))
 
 
 @warn_group.command(name="list", description="List a member's warns")
 @has_mod_perms()
 async def warn_list(interaction: discord.Interaction, member: discord.Member):
-    res = supabase.table("warns").select("*").eq("guild_id", interaction.guild_id).eq("user_id", member.id).order("created_at", desc=True).execute()
+    res = await db.table("warns").select("*").eq("guild_id", interaction.guild_id).eq("user_id", member.id).order("created_at", desc=True).execute()
     if not res.data:
         return await interaction.response.send_message(embed=make_embed("⚠️ Warns", "No warns found.", discord.Color.blurple(), bot.user))
     desc = "\n".join(f"**#{i+1}** — {w['reason']} (by <@{w['moderator_id']}>)" for i, w in enumerate(res.data[:15]))
@@ -844,51 +1659,94 @@ async def slowmode_cmd(interaction: discord.Interaction, seconds: app_commands.R
 # 10. CUSTOM COMMAND SYSTEM
 # ==================================================================
 
+CUSTOM_COMMAND_VARS = re.compile(r"\{(user|server|membercount)\}")
+
+bot.custom_command_index: dict[int, dict[str, list[str]]] = {}  # guild_id -> {name: parsed response}
+bot.custom_command_loading: dict[int, asyncio.Task] = {}
+bot.custom_command_generations: dict[Optional[int], int] = {}
+
+
+def parse_custom_response(response: str) -> list[str]:
+    """Split a response template once; odd indices are placeholder names."""
+    return CUSTOM_COMMAND_VARS.split(response)
+
+
+def render_custom_response(parts: list[str], message: discord.Message) -> str:
+    values = {"user": message.author.mention, "server": message.guild.name, "membercount": str(message.guild.member_count)}
+    return "".join(values[p] if i % 2 else p for i, p in enumerate(parts))
+
+
+@on_invalidate("custom_commands")
+def _invalidate_custom_commands(guild_id: Optional[int]):
+    bump_generation(bot.custom_command_generations, guild_id)
+    if guild_id is None:
+        bot.custom_command_index.clear()
+        bot.custom_command_loading.clear()
+    else:
+        bot.custom_command_index.pop(guild_id, None)
+        bot.custom_command_loading.pop(guild_id, None)
+
+
+async def get_custom_command_index(guild_id: int) -> dict[str, list[str]]:
+    """Every command of a guild, loaded in one query. Because the index is
+    complete, a name missing from it is known not to exist (no DB lookup)."""
+    index = bot.custom_command_index.get(guild_id)
+    if index is not None:
+        return index
+
+    async def load():
+        generation = current_generation(bot.custom_command_generations, guild_id)
+        rows = await select_all(lambda: db.table("custom_commands").select("name,response").eq("guild_id", guild_id).order("name"))
+        loaded = {r["name"]: parse_custom_response(r["response"]) for r in rows}
+        if current_generation(bot.custom_command_generations, guild_id) == generation:
+            bot.custom_command_index[guild_id] = loaded
+        return loaded
+    return await single_flight(bot.custom_command_loading, guild_id, load)
+
+
 customcommand_group = app_commands.Group(name="customcommand", description="Manage custom commands")
 
 
 @customcommand_group.command(name="add", description="Add a custom command")
 @has_mod_perms()
 async def customcommand_add(interaction: discord.Interaction, name: str, response: str):
-    supabase.table("custom_commands").upsert({
+    await db.table("custom_commands").upsert({
         "guild_id": interaction.guild_id, "name": name.lower(), "response": response
     }, on_conflict="guild_id,name").execute()
+    await publish_invalidation("custom_commands", interaction.guild_id)
     await interaction.response.send_message(embed=make_embed("✅ Custom Command Added", f"`{name}` → {response[:100]}", discord.Color.green(), bot.user), ephemeral=True)
 
 
 @customcommand_group.command(name="remove", description="Remove a custom command")
 @has_mod_perms()
 async def customcommand_remove(interaction: discord.Interaction, name: str):
-    supabase.table("custom_commands").delete().eq("guild_id", interaction.guild_id).eq("name", name.lower()).execute()
+    await db.table("custom_commands").delete().eq("guild_id", interaction.guild_id).eq("name", name.lower()).execute()
+    await publish_invalidation("custom_commands", interaction.guild_id)
     await interaction.response.send_message(embed=make_embed("✅ Custom Command Removed", f"`{name}` removed.", discord.Color.green(), bot.user), ephemeral=True)
 
 
 @customcommand_group.command(name="list", description="List all custom commands")
 async def customcommand_list(interaction: discord.Interaction):
-    res = supabase.table("custom_commands").select("name").eq("guild_id", interaction.guild_id).execute()
-    names = ", ".join(f"`{r['name']}`" for r in res.data) or "None configured."
+    index = await get_custom_command_index(interaction.guild_id)
+    names = ", ".join(f"`{name}`" for name in index) or "None configured."
     await interaction.response.send_message(embed=make_embed("📜 Custom Commands", names, discord.Color.blurple(), bot.user))
 
 
 bot.tree.add_command(customcommand_group)
 
 
-async def handle_custom_command(message: discord.Message):
-    cfg = await get_guild_config(message.guild.id)
+async def handle_custom_command(message: discord.Message, cfg: dict):
     prefix = cfg.get("prefix", "!")
     if not message.content.startswith(prefix):
         return
     name = message.content[len(prefix):].split(" ")[0].lower()
     if not name:
         return
-    res = supabase.table("custom_commands").select("response").eq("guild_id", message.guild.id).eq("name", name).execute()
-    if not res.data:
+    index = await get_custom_command_index(message.guild.id)
+    parts = index.get(name)
+    if parts is None:
         return
-    response = res.data[0]["response"]
-    response = response.replace("{user}", message.author.mention)
-    response = response.replace("{server}", message.guild.name)
-    response = response.replace("{membercount}", str(message.guild.member_count))
-    await message.channel.send(response)
+    await message.channel.send(render_custom_response(parts, message))
 
 
 # ==================================================================
@@ -949,7 +1807,7 @@ async def create_ticket(interaction: discord.Interaction, category_name: str):
     channel_name = f"ticket-{category_name.lower()}-{interaction.user.name}"[:95]
     channel = await guild.create_text_channel(channel_name, category=category, overwrites=overwrites)
 
-    supabase.table("tickets").insert({
+    await db.table("tickets").insert({
         "guild_id": guild.id, "channel_id": channel.id, "user_id": interaction.user.id,
         "category": category_name, "status": "open", "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
     }).execute()
@@ -961,7 +1819,7 @@ async def create_ticket(interaction: discord.Interaction, category_name: str):
 
 async def close_ticket(interaction: discord.Interaction):
     channel = interaction.channel
-    res = supabase.table("tickets").select("*").eq("channel_id", channel.id).execute()
+    res = await db.table("tickets").select("*").eq("channel_id", channel.id).execute()
     if not res.data:
         return await interaction.response.send_message("This isn't a ticket channel.", ephemeral=True)
     ticket = res.data[0]
@@ -986,7 +1844,7 @@ async def close_ticket(interaction: discord.Interaction):
                 file=discord.File(io.BytesIO(transcript_text.encode()), filename=f"transcript-{channel.name}.txt"),
             )
 
-    supabase.table("tickets").update({"status": "closed"}).eq("channel_id", channel.id).execute()
+    await db.table("tickets").update({"status": "closed"}).eq("channel_id", channel.id).execute()
 
     # DM user with transcript + rating request
     ticket_user = interaction.guild.get_member(ticket["user_id"]) or await bot.fetch_user(ticket["user_id"])
@@ -1017,7 +1875,7 @@ class RatingButton(discord.ui.Button):
         self.ticket_id = ticket_id
 
     async def callback(self, interaction: discord.Interaction):
-        supabase.table("ticket_ratings").insert({"ticket_id": self.ticket_id, "user_id": interaction.user.id, "rating": self.stars}).execute()
+        await db.table("ticket_ratings").insert({"ticket_id": self.ticket_id, "user_id": interaction.user.id, "rating": self.stars}).execute()
         await interaction.response.edit_message(content=f"Thanks for rating {self.stars} stars!", view=None)
 
 
@@ -1047,7 +1905,7 @@ async def ticketconfig_cmd(interaction: discord.Interaction, category: Optional[
 
 @bot.tree.command(name="ticketstats", description="View average staff ratings")
 async def ticketstats_cmd(interaction: discord.Interaction):
-    res = supabase.table("ticket_ratings").select("rating").execute()
+    res = await db.table("ticket_ratings").select("rating").execute()
     if not res.data:
         return await interaction.response.send_message(embed=make_embed("⭐ Ticket Stats", "No ratings yet.", discord.Color.blurple(), bot.user))
     avg = sum(r["rating"] for r in res.data) / len(res.data)
@@ -1106,7 +1964,7 @@ def fill_vars(text: str, member: discord.Member) -> str:
 @bot.event
 async def on_member_join(member: discord.Member):
     cfg = await get_guild_config(member.guild.id)
-    await handle_invite_join(member)
+    invite_joins.report(member)
 
     channel_id = cfg.get("welcome_channel")
     if channel_id:
@@ -1120,8 +1978,8 @@ async def on_member_join(member: discord.Member):
     await update_membercount_channel(member.guild)
 
 
-@bot.event
-async def on_member_remove(member: discord.Member):  # noqa: F811 (extends earlier handler intentionally via separate listener)
+@bot.listen("on_member_remove")
+async def goodbye_on_member_remove(member: discord.Member):
     cfg = await get_guild_config(member.guild.id)
     channel_id = cfg.get("goodbye_channel")
     if channel_id:
@@ -1174,13 +2032,28 @@ async def dmall_cmd(interaction: discord.Interaction, title: str, message: str):
     # timing out and hammering Discord's global rate limit), we enqueue a job row
     # and let a background worker (dm_queue_worker) drain it at a safe, steady rate.
     member_ids = [m.id for m in interaction.guild.members if not m.bot]
-    job = supabase.table("dm_jobs").insert({
+    chunks = await asyncio.to_thread(pack_dm_targets, member_ids)
+    job = await db.table("dm_jobs").insert({
         "guild_id": interaction.guild_id, "requested_by": interaction.user.id,
-        "title": title, "message": message, "targets": json.dumps(member_ids),
-        "sent": 0, "failed": 0, "status": "queued",
+        "title": title, "message": message, "total": len(member_ids),
+        "chunk_size": DM_TARGET_CHUNK_SIZE, "cursor": 0,
+        "sent": 0, "failed": 0, "status": "preparing",
         "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
     }).execute()
     job_id = job.data[0]["id"]
+    rows = [{"job_id": job_id, "chunk_index": i, "count": count, "data": data} for i, (count, data) in enumerate(chunks)]
+    try:
+        for i in range(0, len(rows), 20):
+            await db.table("dm_job_targets").insert(rows[i:i + 20]).execute()
+        await db.table("dm_jobs").update({"status": "queued"}).eq("id", job_id).execute()
+    except Exception as e:
+        logger.error(f"dmall prepare error (job {job_id}): {e}")
+        try:
+            await db.table("dm_job_targets").delete().eq("job_id", job_id).execute()
+            await db.table("dm_jobs").delete().eq("id", job_id).execute()
+        except Exception as cleanup_error:
+            logger.error(f"dmall cleanup error (job {job_id}): {cleanup_error}")
+        return await interaction.followup.send(embed=make_embed("❌ Mass DM Failed", "Couldn't queue the job. Please try again.", discord.Color.red(), bot.user))
 
     await interaction.followup.send(embed=make_embed(
         "📨 Mass DM Queued", f"Job `#{job_id}` queued for **{len(member_ids)}** members. "
@@ -1190,11 +2063,14 @@ async def dmall_cmd(interaction: discord.Interaction, title: str, message: str):
 @bot.tree.command(name="dmjobstatus", description="Check the progress of a mass DM job")
 @has_admin_perms()
 async def dmjobstatus_cmd(interaction: discord.Interaction, job_id: int):
-    res = supabase.table("dm_jobs").select("*").eq("id", job_id).execute()
+    res = await db.table("dm_jobs").select("status,total,sent,failed").eq("id", job_id).execute()
     if not res.data:
         return await interaction.response.send_message(embed=make_embed("❌ Error", "Job not found.", discord.Color.red(), bot.user), ephemeral=True)
     job = res.data[0]
-    total = len(json.loads(job["targets"]))
+    total = job["total"]
+    if total is None:  # job queued before targets were chunked
+        legacy = await db.table("dm_jobs").select("targets").eq("id", job_id).execute()
+        total = len(json.loads(legacy.data[0]["targets"]))
     embed = make_embed(f"📨 DM Job #{job_id}", color=discord.Color.blurple(), bot_user=bot.user)
     embed.add_field(name="Status", value=job["status"], inline=True)
     embed.add_field(name="Progress", value=f"{job['sent'] + job['failed']}/{total}", inline=True)
@@ -1203,49 +2079,306 @@ async def dmjobstatus_cmd(interaction: discord.Interaction, job_id: int):
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 
-# Global concurrency-safe rate limit for outbound DMs across ALL queued jobs
-# (Discord's practical safe DM rate is well under 1/sec sustained).
-DM_QUEUE_RATE_SECONDS = 1.2
-
+# /dmall targets are stored as sorted member IDs, delta-encoded into packed
+# little-endian uint64 arrays, zlib-compressed and base64'd, in fixed-size
+# chunks (dm_job_targets rows) that the dispatcher fetches one at a time. The
+# dm_jobs row itself only carries counts and the cursor.
+DM_TARGET_CHUNK_SIZE = 10_000
+
+
+def pack_member_ids(ids: list[int]) -> str:
+    deltas = array("Q")
+    prev = 0
+    for member_id in ids:
+        deltas.append(member_id - prev)
+        prev = member_id
+    if sys.byteorder == "big":
+        deltas.byteswap()
+    return base64.b64encode(zlib.compress(deltas.tobytes(), 6)).decode()
+
+
+def unpack_member_ids(data: str) -> list[int]:
+    deltas = array("Q")
+    deltas.frombytes(zlib.decompress(base64.b64decode(data)))
+    if sys.byteorder == "big":
+        deltas.byteswap()
+    return list(itertools.accumulate(deltas))
+
+
+def pack_dm_targets(member_ids: list[int]) -> list[tuple[int, str]]:
+    """Sort and split into (count, packed) chunks. CPU-bound; run off the loop."""
+    member_ids = sorted(member_ids)
+    return [(len(member_ids[i:i + DM_TARGET_CHUNK_SIZE]), pack_member_ids(member_ids[i:i + DM_TARGET_CHUNK_SIZE]))
+            for i in range(0, len(member_ids), DM_TARGET_CHUNK_SIZE)]
+
+
+# Outbound DMs across ALL jobs share one token bucket. It starts at a safe
+# rate and adapts: every clean send nudges the rate up, while a 429 (or a send
+# that stalled inside discord.py's own rate-limit sleep) halves it and pauses
+# the bucket for the advertised retry_after.
+DM_RATE_INITIAL = 1.0          # DMs per second
+DM_RATE_MIN = 0.2
+DM_RATE_MAX = 4.0
+DM_RATE_STEP = 0.02            # additive increase per successful DM
+DM_SLOW_SEND_SECONDS = 3.0     # a send slower than this was throttled by the library
+DM_CHECKPOINT_EVERY = 25       # persist each job's cursor after this many targets
+DM_JOB_MAX_ERRORS = 5          # consecutive unexpected errors before a job is failed
+DM_JOB_BACKOFF_MAX = 60.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, min_rate: float, max_rate: float, step: float):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.step = step
+        self.capacity = 1.0
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.step)
+
+    def on_rate_limited(self, retry_after: float = 0.0):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+
+class _DmJob:
+    __slots__ = ("id", "guild_id", "embed", "total", "chunk_size", "chunk_index", "chunk",
+                 "cursor", "sent", "failed", "unsaved", "errors", "retry_at")
+
+    def __init__(self, row: dict):
+        self.id = row["id"]
+        self.guild_id = row["guild_id"]
+        self.embed = make_embed(row["title"], row["message"], discord.Color.blurple(), bot.user)
+        self.sent = row["sent"]
+        self.failed = row["failed"]
+        cursor = row.get("cursor")
+        self.cursor = cursor if cursor is not None else self.sent + self.failed
+        self.unsaved = 0
+        self.errors = 0         # consecutive failed steps
+        self.retry_at = 0.0     # monotonic time before which the job is skipped
+        if row.get("targets"):  # job queued before targets were chunked: one in-memory chunk
+            self.chunk = json.loads(row["targets"])
+            self.total = len(self.chunk)
+            self.chunk_size = max(1, self.total)
+            self.chunk_index = 0
+        else:
+            self.chunk = []
+            self.total = row["total"]
+            self.chunk_size = row["chunk_size"]
+            self.chunk_index = -1
+
+    @property
+    def done(self) -> bool:
+        return self.cursor >= self.total
+
+    async def current_target(self) -> Optional[int]:
+        """The member ID at the cursor, or None if its chunk row is missing."""
+        index = self.cursor // self.chunk_size
+        if index != self.chunk_index:
+            res = await db.table("dm_job_targets").select("data").eq("job_id", self.id).eq("chunk_index", index).execute()
+            if not res.data:
+                return None
+            self.chunk = unpack_member_ids(res.data[0]["data"])
+            self.chunk_index = index
+        offset = self.cursor % self.chunk_size
+        return self.chunk[offset] if offset < len(self.chunk) else None
+
+
+class DmDispatcher:
+    """Drains every running DM job through one shared TokenBucket. Guilds take
+    turns, and within a guild its jobs take turns, so one huge job can't
+    starve the rest. Each job keeps a cursor into its target list that is
+    checkpointed every DM_CHECKPOINT_EVERY targets and on shutdown, so a
+    restart resumes where the last checkpoint left off."""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.jobs: dict[int, _DmJob] = {}
+        self.guild_jobs: dict[int, deque] = {}   # guild_id -> job ids, rotated
+        self.guild_order: deque = deque()        # guild ids, rotated
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def add(self, job: _DmJob):
+        if job.id in self.jobs:
+            return
+        self.jobs[job.id] = job
+        if job.guild_id not in self.guild_jobs:
+            self.guild_jobs[job.guild_id] = deque()
+            self.guild_order.append(job.guild_id)
+        self.guild_jobs[job.guild_id].append(job.id)
+        self.wakeup.set()
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    def _remove(self, job: _DmJob):
+        self.jobs.pop(job.id, None)
+        queue = self.guild_jobs[job.guild_id]
+        queue.remove(job.id)
+        if not queue:
+            del self.guild_jobs[job.guild_id]
+            self.guild_order.remove(job.guild_id)
+
+    def _next_job(self) -> Optional[_DmJob]:
+        """Next job in turn that isn't backing off, or None if all of them are."""
+        now = time.monotonic()
+        for _ in range(len(self.jobs)):
+            guild_id = self.guild_order[0]
+            self.guild_order.rotate(-1)
+            queue = self.guild_jobs[guild_id]
+            job_id = queue[0]
+            queue.rotate(-1)
+            if self.jobs[job_id].retry_at <= now:
+                return self.jobs[job_id]
+        return None
 
-@tasks.loop(seconds=5)
-async def dm_queue_worker():
-    """Background worker that drains queued dm_jobs at a steady, safe rate.
-    Runs independently of any single interaction so it survives Discord API
-    hiccups and doesn't hold an interaction/response open for a long-running job."""
-    try:
-        res = supabase.table("dm_jobs").select("*").eq("status", "queued").order("created_at").limit(1).execute()
-        if not res.data:
+    async def _run(self):
+        while True:
+            if not self.jobs:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            job = self._next_job()
+            if job is None:
+                self.wakeup.clear()
+                delay = min(j.retry_at for j in self.jobs.values()) - time.monotonic()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=max(0.0, delay))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._step(job)
+                job.errors = 0
+            except Exception as e:
+                job.errors += 1
+                logger.error(f"dm dispatcher error (job {job.id}, attempt {job.errors}): {e}")
+                if job.errors >= DM_JOB_MAX_ERRORS:
+                    await self._give_up(job)
+                else:
+                    job.retry_at = time.monotonic() + min(DM_JOB_BACKOFF_MAX, 2 ** job.errors)
+
+    async def _give_up(self, job: _DmJob):
+        try:
+            await self._finish(job, "failed")
+        except Exception as e:
+            logger.error(f"dm job {job.id} could not be marked failed: {e}")
+
+    async def _finish(self, job: _DmJob, status: str):
+        """Terminal path for every job: stop serving it, record the final
+        status and drop its target chunks."""
+        if job.id in self.jobs:
+            self._remove(job)
+        await self._checkpoint(job, status)
+        await db.table("dm_job_targets").delete().eq("job_id", job.id).execute()
+
+    async def _step(self, job: _DmJob):
+        guild = bot.get_guild(job.guild_id)
+        if not guild or job.done:
+            await self._finish(job, "done" if guild else "failed")
             return
-        job = res.data[0]
-        supabase.table("dm_jobs").update({"status": "running"}).eq("id", job["id"]).execute()
 
-        guild = bot.get_guild(job["guild_id"])
-        if not guild:
-            supabase.table("dm_jobs").update({"status": "failed"}).eq("id", job["id"]).execute()
+        target = await job.current_target()
+        if target is None:
+            logger.error(f"dm job {job.id}: target chunk missing at cursor {job.cursor}")
+            await self._finish(job, "failed")
             return
+        member = guild.get_member(target)
+        if member:
+            await self.bucket.acquire()
+            started = time.monotonic()
+            try:
+                await member.send(embed=job.embed)
+                ok = True
+            except discord.RateLimited as e:
+                self.bucket.on_rate_limited(e.retry_after)
+                return  # same target again on this job's next turn
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    self.bucket.on_rate_limited(float(e.response.headers.get("Retry-After", 1)))
+                    return
+                ok = False
+            if time.monotonic() - started > DM_SLOW_SEND_SECONDS:
+                self.bucket.on_rate_limited()
+            elif ok:
+                self.bucket.on_success()
+        else:
+            ok = False
+
+        job.cursor += 1
+        job.sent += 1 if ok else 0
+        job.failed += 0 if ok else 1
+        job.unsaved += 1
+        if job.done:
+            await self._finish(job, "done")
+        elif job.unsaved >= DM_CHECKPOINT_EVERY:
+            await self._checkpoint(job, "running")
+
+    async def _checkpoint(self, job: _DmJob, status: str):
+        await db.table("dm_jobs").update({
+            "sent": job.sent, "failed": job.failed, "cursor": job.cursor, "status": status,
+        }).eq("id", job.id).execute()
+        job.unsaved = 0
+
+    async def checkpoint_all(self):
+        for job in list(self.jobs.values()):
+            if job.unsaved:
+                try:
+                    await self._checkpoint(job, "running")
+                except Exception as e:
+                    logger.error(f"dm checkpoint error (job {job.id}): {e}")
 
-        embed = make_embed(job["title"], job["message"], discord.Color.blurple(), bot.user)
-        targets = json.loads(job["targets"])
-        sent, failed = job["sent"], job["failed"]
-
-        # Process in small batches per worker tick so we never block the event
-        # loop for the whole job, and other bot activity stays responsive.
-        batch = targets[sent + failed: sent + failed + 20]
-        for user_id in batch:
-            member = guild.get_member(user_id)
-            if not member:
-                failed += 1
-                continue
-            ok = await dm_user_safely(member, embed)
-            sent += 1 if ok else 0
-            failed += 0 if ok else 1
-            await asyncio.sleep(DM_QUEUE_RATE_SECONDS)
-
-        done = (sent + failed) >= len(targets)
-        supabase.table("dm_jobs").update({
-            "sent": sent, "failed": failed, "status": "done" if done else "queued"
-        }).eq("id", job["id"]).execute()
+
+dm_dispatcher = DmDispatcher(TokenBucket(DM_RATE_INITIAL, DM_RATE_MIN, DM_RATE_MAX, DM_RATE_STEP))
+bot.dm_jobs_resumed = False
+
+
+@tasks.loop(seconds=5)
+async def dm_queue_worker():
+    """Hands newly queued dm_jobs for this process's guilds to the dispatcher.
+    On the first tick it also resumes jobs that were running when the bot last
+    stopped (a guild is only ever served by one process, so they are ours).
+    Rows are paged by id so other processes' jobs can't crowd ours out."""
+    try:
+        statuses = ["queued"] if bot.dm_jobs_resumed else ["queued", "running"]
+        last_id = 0
+        while True:
+            res = await db.table("dm_jobs").select("*").in_("status", statuses).gt("id", last_id).order("id").limit(50).execute()
+            for row in res.data:
+                if row["id"] in dm_dispatcher.jobs or not bot.get_guild(row["guild_id"]):
+                    continue
+                if row["status"] == "queued":
+                    claimed = await db.table("dm_jobs").update({"status": "running"}).eq("id", row["id"]).eq("status", "queued").execute()
+                    if not claimed.data:
+                        continue
+                try:
+                    dm_dispatcher.add(_DmJob(row))
+                except Exception as e:  # malformed row: don't let it block the queue
+                    logger.error(f"dm job {row['id']} could not be loaded: {e}")
+                    await db.table("dm_jobs").update({"status": "failed"}).eq("id", row["id"]).execute()
+                    await db.table("dm_job_targets").delete().eq("job_id", row["id"]).execute()
+            if len(res.data) < 50:
+                break
+            last_id = res.data[-1]["id"]
+        bot.dm_jobs_resumed = True
     except Exception as e:
         logger.error(f"dm_queue_worker error: {e}")
 
@@ -1254,63 +2387,331 @@ async def dm_queue_worker():
 # 14. INVITE TRACKING SYSTEM
 # ==================================================================
 
-@bot.event
-async def on_ready_populate_invites():
-    for guild in bot.guilds:
-        try:
-            invites = await guild.invites()
-            bot.invite_cache[guild.id] = {inv.code: inv.uses for inv in invites}
-        except discord.Forbidden:
-            bot.invite_cache[guild.id] = {}
+# Invite snapshots ({"fetched_at", "uses": {code: uses}} per guild) live in the
+# invite_cache namespace, so with Redis they survive reconnects and are shared
+# across shards. A snapshot fetched before this process started (minus a small
+# margin) may predate uses gained while the bot was down, so it is never
+# diffed against: startup re-fetches those, and any guild with no fresh
+# snapshot yet when a join arrives gets its baseline from that join's fetch.
+# Warmup runs in the background with bounded concurrency, once per process (not
+# on every reconnect), only where the bot has Manage Guild. Stores keep
+# whichever snapshot was fetched last, so a slow warmup fetch can't replace a
+# newer one written by a join batch.
+INVITE_WARMUP_CONCURRENCY = 8
+INVITE_WARMUP_BATCH = 100
+INVITE_SNAPSHOT_TTL = 7 * 24 * 3600
+INVITE_SNAPSHOT_MARGIN = 60
+INVITE_SNAPSHOT_STORE_LUA = """
+local current = redis.call('GET', KEYS[1])
+if current then
+    local ok, snap = pcall(cjson.decode, current)
+    if ok and type(snap) == 'table' and type(snap['fetched_at']) == 'number'
+            and snap['fetched_at'] >= tonumber(ARGV[2]) then
+        return 0
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+bot.invite_warmup_task: Optional[asyncio.Task] = None
 
 
-async def handle_invite_join(member: discord.Member):
-    guild = member.guild
-    try:
-        new_invites = await guild.invites()
-    except discord.Forbidden:
+def invite_snapshot(invites: list[discord.Invite]) -> dict:
+    return {"fetched_at": time.time(), "uses": {inv.code: inv.uses or 0 for inv in invites}}
+
+
+def invite_snapshot_fresh(snapshot: Optional[dict]) -> bool:
+    """Taken by this process (not carried over a restart), so it's safe to diff."""
+    return (isinstance(snapshot, dict) and isinstance(snapshot.get("fetched_at"), (int, float))
+            and snapshot["fetched_at"] >= bot.start_time - INVITE_SNAPSHOT_MARGIN)
+
+
+async def store_invite_snapshots(snapshots: dict[int, dict]):
+    """Store snapshots unless the one already stored was fetched later."""
+    if not snapshots:
         return
-    old = bot.invite_cache.get(guild.id, {})
-    used_invite = None
-    for inv in new_invites:
-        if inv.uses > old.get(inv.code, 0):
-            used_invite = inv
-            break
-    bot.invite_cache[guild.id] = {inv.code: inv.uses for inv in new_invites}
+    if bot.redis:
+        dumps = _serializer("invite_cache")[0]
+        pipe = bot.redis_raw.pipeline(transaction=False)
+        for guild_id, snap in snapshots.items():
+            pipe.eval(INVITE_SNAPSHOT_STORE_LUA, 1, f"invite_cache:{guild_id}", dumps(snap), snap["fetched_at"], INVITE_SNAPSHOT_TTL)
+        await pipe.execute()
+        return
+    for guild_id, snap in snapshots.items():
+        current = bot.invite_cache.get(guild_id)
+        if not (isinstance(current, dict) and current.get("fetched_at", 0) >= snap["fetched_at"]):
+            bot.invite_cache[guild_id] = snap
+
+
+async def warm_invite_cache():
+    limit = asyncio.Semaphore(INVITE_WARMUP_CONCURRENCY)
+
+    async def fetch(guild: discord.Guild, snapshots: dict):
+        async with limit:
+            try:
+                snapshots[guild.id] = invite_snapshot(await guild.invites())
+            except discord.HTTPException:
+                pass
+
+    guilds = [g for g in bot.guilds if g.me and g.me.guild_permissions.manage_guild]
+    warmed = 0
+    for i in range(0, len(guilds), INVITE_WARMUP_BATCH):
+        batch = guilds[i:i + INVITE_WARMUP_BATCH]
+        try:
+            known = await cache_get_many("invite_cache", [g.id for g in batch])
+            snapshots = {}
+            await asyncio.gather(*(fetch(g, snapshots) for g, snap in zip(batch, known) if not invite_snapshot_fresh(snap)))
+            await store_invite_snapshots(snapshots)
+            warmed += len(snapshots)
+        except Exception as e:
+            logger.error(f"invite warmup error: {e}")
+    logger.info(f"Invite cache warmed for {warmed} guilds ({len(guilds)} eligible).")
+
+
+# A raid fires hundreds of joins per second. Rather than one guild.invites()
+# fetch per join (rate limited, and racing on invite_cache), joins are queued
+# per guild and drained after a short debounce: one fetch, one diff against the
+# cached use counts, one bulk insert. Only one drain runs per guild, so diffs
+# are applied in order. When several invites gained uses within one batch,
+# joiners are matched to them in join order; Discord gives nothing finer.
+INVITE_JOIN_DEBOUNCE_SECONDS = 1.0
+
+
+class InviteJoinBatcher:
+    def __init__(self, debounce: float):
+        self.debounce = debounce
+        self.pending: dict[int, list[discord.Member]] = {}
+        self.drains: dict[int, asyncio.Task] = {}
+
+    def report(self, member: discord.Member):
+        guild_id = member.guild.id
+        self.pending.setdefault(guild_id, []).append(member)
+        if guild_id not in self.drains:
+            self.drains[guild_id] = asyncio.create_task(self._drain(member.guild))
+
+    async def _drain(self, guild: discord.Guild):
+        try:
+            while self.pending.get(guild.id):
+                await asyncio.sleep(self.debounce)
+                members = self.pending.pop(guild.id, [])
+                try:
+                    await self._attribute(guild, members)
+                except Exception as e:
+                    logger.error(f"invite attribution error: {e}")
+        finally:
+            self.drains.pop(guild.id, None)
 
-    if used_invite:
-        supabase.table("invites").insert({
-            "guild_id": guild.id, "inviter_id": used_invite.inviter.id if used_invite.inviter else None,
-            "invited_id": member.id, "code": used_invite.code, "status": "active",
-            "joined_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
-        }).execute()
+    async def _attribute(self, guild: discord.Guild, members: list[discord.Member]):
+        try:
+            invites = await guild.invites()
+        except discord.Forbidden:
+            return
+        old = await cache_get("invite_cache", guild.id)
+        await store_invite_snapshots({guild.id: invite_snapshot(invites)})
+        if not invite_snapshot_fresh(old):
+            return  # no trustworthy baseline yet: this fetch becomes it, the batch can't be attributed
+
+        used = []  # one entry per use gained since the last snapshot
+        for inv in invites:
+            gained = (inv.uses or 0) - old["uses"].get(inv.code, 0)
+            used.extend([inv] * min(max(gained, 0), len(members) - len(used)))
+        now = datetime.datetime.now(datetime.timezone.utc)
+        rows = [{
+            "guild_id": guild.id, "inviter_id": inv.inviter.id if inv.inviter else None,
+            "invited_id": member.id, "code": inv.code, "status": "active",
+            "joined_at": (member.joined_at or now).isoformat()
+        } for member, inv in zip(members, used)]
+        if rows:
+            await invite_counters.guild(guild.id)  # load (or backfill) before adding rows
+            await db.table("invites").insert(rows).execute()
+            deltas = {}
+            for r in rows:
+                if r["inviter_id"] is not None:
+                    d = deltas.setdefault(r["inviter_id"], [0, 0, 0])
+                    d[0] += 1
+                    d[1] += 1
+            await invite_counters.apply(guild.id, deltas)
+
+
+invite_joins = InviteJoinBatcher(INVITE_JOIN_DEBOUNCE_SECONDS)
 
 
 async def handle_invite_leave(member: discord.Member):
-    supabase.table("invites").update({"status": "left"}).eq("guild_id", member.guild.id).eq("invited_id", member.id).execute()
+    await invite_counters.guild(member.guild.id)  # load (or backfill) before changing rows
+    res = await db.table("invites").update({"status": "left"}).eq("guild_id", member.guild.id).eq("invited_id", member.id).eq("status", "active").execute()
+    deltas = {}
+    for r in res.data:
+        if r.get("inviter_id") is not None:
+            d = deltas.setdefault(r["inviter_id"], [0, 0, 0])
+            d[1] -= 1
+            d[2] += 1
+    await invite_counters.apply(member.guild.id, deltas)
+
+
+# Per-inviter [total, active, left] counts per guild, adjusted by joins and
+# leaves and written through to invite_counters, so /invites and the
+# leaderboard never scan the invites table. The leaderboard ranks by active.
+# A guild with no counter rows and no invite_backfills row is backfilled from
+# its invites rows once; startup runs those backfills in the background, so a
+# join or leave only ever waits on one that is already in flight. Saves write
+# absolute values, so they are serialized per guild and each one writes the
+# counts current when it runs: an older snapshot can never land after a newer
+# one, and changes queued behind a running save share the next. Like
+# RankedIndex, only the most recently used guilds stay in memory; guilds with
+# unsaved changes or a save in flight are never dropped.
+INVITE_COUNTERS_MAX_GUILDS = RANKED_INDEX_MAX_SCOPES
+bot.invite_backfill_task: Optional[asyncio.Task] = None
+
+
+class InviteCounters:
+    def __init__(self, max_guilds: int = INVITE_COUNTERS_MAX_GUILDS):
+        self.max_guilds = max_guilds
+        self.guilds: OrderedDict = OrderedDict()  # guild_id -> {inviter_id: [total, active, left]}
+        self.loading: dict[int, asyncio.Task] = {}
+        self.dirty: dict[int, set[int]] = {}  # guild_id -> inviters changed since the last save
+        self.save_locks: dict[int, asyncio.Lock] = {}
+
+    async def _load(self, guild_id: int) -> dict[int, list[int]]:
+        rows = await select_all(lambda: db.table("invite_counters").select("inviter_id,total,active,left")
+                                .eq("guild_id", guild_id).order("inviter_id"))
+        counts = {r["inviter_id"]: [r["total"], r["active"], r["left"]] for r in rows}
+        if not counts:
+            marked = await db.table("invite_backfills").select("guild_id").eq("guild_id", guild_id).execute()
+            if not marked.data:
+                counts = await self._backfill(guild_id)
+        self.guilds[guild_id] = counts
+        self._evict()
+        return counts
+
+    async def _backfill(self, guild_id: int) -> dict[int, list[int]]:
+        counts = {}
+        invites = await select_all(lambda: db.table("invites").select("id,inviter_id,status")
+                                   .eq("guild_id", guild_id).order("id"))
+        for r in invites:
+            if r["inviter_id"] is None:
+                continue
+            c = counts.setdefault(r["inviter_id"], [0, 0, 0])
+            c[0] += 1
+            c[1 if r["status"] == "active" else 2] += 1
+        await self._save(guild_id, counts)
+        await db.table("invite_backfills").upsert({"guild_id": guild_id}, on_conflict="guild_id").execute()
+        return counts
+
+    def _evict(self):
+        excess = len(self.guilds) - self.max_guilds
+        for guild_id in list(self.guilds):
+            if excess <= 0:
+                break
+            lock = self.save_locks.get(guild_id)
+            if guild_id in self.dirty or (lock and lock.locked()):
+                continue
+            del self.guilds[guild_id]
+            self.save_locks.pop(guild_id, None)
+            excess -= 1
+
+    async def guild(self, guild_id: int) -> dict[int, list[int]]:
+        counts = self.guilds.get(guild_id)
+        if counts is None:
+            return await single_flight(self.loading, guild_id, lambda: self._load(guild_id))
+        self.guilds.move_to_end(guild_id)
+        return counts
+
+    async def _save(self, guild_id: int, counts: dict[int, list[int]]):
+        rows = [{"guild_id": guild_id, "inviter_id": inviter, "total": c[0], "active": c[1], "left": c[2]}
+                for inviter, c in counts.items()]
+        for i in range(0, len(rows), 500):
+            await db.table("invite_counters").upsert(rows[i:i + 500], on_conflict="guild_id,inviter_id").execute()
+
+    async def apply(self, guild_id: int, deltas: dict[int, list[int]]):
+        """Add [total, active, left] deltas per inviter."""
+        if not deltas:
+            return
+        counts = await self.guild(guild_id)
+        dirty = self.dirty.setdefault(guild_id, set())
+        for inviter, delta in deltas.items():
+            c = counts.setdefault(inviter, [0, 0, 0])
+            for i in range(3):
+                c[i] = max(0, c[i] + delta[i])
+            dirty.add(inviter)
+            invite_rank.update(guild_id, inviter, c[1])
+        await self._flush(guild_id)
+
+    async def _flush(self, guild_id: int):
+        async with self.save_locks.setdefault(guild_id, asyncio.Lock()):
+            dirty = self.dirty.pop(guild_id, None)
+            if not dirty:
+                return  # already written by the save we were queued behind
+            counts = self.guilds[guild_id]
+            try:
+                await self._save(guild_id, {inviter: counts[inviter] for inviter in dirty})
+            except Exception:
+                self.dirty.setdefault(guild_id, set()).update(dirty)
+                raise
+
+    async def get(self, guild_id: int, inviter_id: int) -> list[int]:
+        return list((await self.guild(guild_id)).get(inviter_id, [0, 0, 0]))
+
+
+async def _load_invite_rank(guild_id: int) -> dict[int, int]:
+    return {inviter: c[1] for inviter, c in (await invite_counters.guild(guild_id)).items()}
+
+
+invite_counters = InviteCounters()
+invite_rank = RankedIndex(_load_invite_rank)
+
+
+async def backfill_invite_counters():
+    """Run the one-time counter backfill for guilds not yet marked as done."""
+    limit = asyncio.Semaphore(INVITE_WARMUP_CONCURRENCY)
+
+    async def load(guild_id: int, loaded: list):
+        async with limit:
+            try:
+                await invite_counters.guild(guild_id)
+                loaded.append(guild_id)
+            except Exception as e:
+                logger.error(f"invite counter backfill error for {guild_id}: {e}")
+
+    guild_ids = [g.id for g in bot.guilds]
+    pending = 0
+    for i in range(0, len(guild_ids), INVITE_WARMUP_BATCH):
+        batch = guild_ids[i:i + INVITE_WARMUP_BATCH]
+        try:
+            res = await db.table("invite_backfills").select("guild_id").in_("guild_id", batch).execute()
+        except Exception as e:
+            logger.error(f"invite counter backfill error: {e}")
+            continue
+        done = {r["guild_id"] for r in res.data}
+        todo = [g for g in batch if g not in done]
+        pending += len(todo)
+        loaded = []
+        await asyncio.gather(*(load(g, loaded) for g in todo))
+        if loaded:
+            # guilds counted before the marker existed have rows already: mark them too
+            try:
+                await db.table("invite_backfills").upsert([{"guild_id": g} for g in loaded], on_conflict="guild_id").execute()
+            except Exception as e:
+                logger.error(f"invite counter backfill error: {e}")
+    logger.info(f"Invite counters checked for {pending} unmarked guilds ({len(guild_ids)} total).")
 
 
 @bot.tree.command(name="invites", description="View invite stats for a user")
 async def invites_cmd(interaction: discord.Interaction, user: Optional[discord.Member] = None):
     user = user or interaction.user
-    res = supabase.table("invites").select("*").eq("guild_id", interaction.guild_id).eq("inviter_id", user.id).execute()
-    total = len(res.data)
-    real = len([r for r in res.data if r["status"] == "active"])
-    fake = total - real
+    total, real, fake = await invite_counters.get(interaction.guild_id, user.id)
+    ranked = await invite_rank.rank(interaction.guild_id, user.id)
     embed = make_embed(f"📨 Invites — {user}", color=discord.Color.blurple(), bot_user=bot.user)
     embed.add_field(name="Total", value=str(total), inline=True)
     embed.add_field(name="Real (still in server)", value=str(real), inline=True)
     embed.add_field(name="Fake (left)", value=str(fake), inline=True)
+    if ranked:
+        embed.add_field(name="Rank", value=f"#{ranked[0]} of {ranked[1]}", inline=True)
     await interaction.response.send_message(embed=embed)
 
 
 @bot.tree.command(name="invitesleaderboard", description="Top inviters leaderboard")
 async def invitesleaderboard_cmd(interaction: discord.Interaction):
-    res = supabase.table("invites").select("inviter_id").eq("guild_id", interaction.guild_id).eq("status", "active").execute()
-    counts = {}
-    for r in res.data:
-        counts[r["inviter_id"]] = counts.get(r["inviter_id"], 0) + 1
-    top = sorted(counts.items(), key=lambda x: x[1], reverse=True)[:10]
+    top, _ = await invite_rank.page(interaction.guild_id, 0, 10)
     if not top:
         return await interaction.response.send_message(embed=make_embed("🏆 Invite Leaderboard", "No data yet.", discord.Color.blurple(), bot.user))
     desc = "\n".join(f"**{i+1}.** <@{uid}> — {count} invites" for i, (uid, count) in enumerate(top))
@@ -1321,6 +2722,94 @@ async def invitesleaderboard_cmd(interaction: discord.Interaction):
 # 15. GIVEAWAYS SYSTEM
 # ==================================================================
 
+# Entries live outside the giveaway row so a click is one atomic add/remove
+# instead of rewriting the whole entrant list (which lost concurrent clicks).
+# With Redis they are a set per giveaway; otherwise a giveaway_entries table
+# with a unique (giveaway_id, user_id) index. Either way a click doesn't scan
+# the entrants and winners are sampled without loading every entrant.
+GIVEAWAY_ENTRY_TOGGLE_LUA = """
+local added = redis.call('SADD', KEYS[1], ARGV[1])
+if added == 0 then
+    redis.call('SREM', KEYS[1], ARGV[1])
+end
+return {added, redis.call('SCARD', KEYS[1])}
+"""
+GIVEAWAY_ENTRIES_RETENTION = 30 * 86400  # keep ended giveaways' entries for rerolls
+
+
+class GiveawayEntryStore:
+    def __init__(self):
+        self._toggle_script = None
+
+    @staticmethod
+    def _key(giveaway_id: int) -> str:
+        return f"giveaway_entries:{giveaway_id}"
+
+    async def toggle(self, giveaway_id: int, user_id: int) -> tuple[bool, int]:
+        """Enter the user, or remove them if already entered. Returns (entered, count)."""
+        if bot.redis:
+            if self._toggle_script is None:
+                self._toggle_script = bot.redis.register_script(GIVEAWAY_ENTRY_TOGGLE_LUA)
+            added, count = await self._toggle_script(keys=[self._key(giveaway_id)], args=[user_id])
+            return bool(added), int(count)
+
+        removed = await db.table("giveaway_entries").delete().eq("giveaway_id", giveaway_id).eq("user_id", user_id).execute()
+        if not removed.data:
+            await db.table("giveaway_entries").upsert({"giveaway_id": giveaway_id, "user_id": user_id},
+                                                      on_conflict="giveaway_id,user_id", ignore_duplicates=True).execute()
+        return not removed.data, await self.count(giveaway_id, exact=False)
+
+    async def add_many(self, giveaway_id: int, user_ids: list[int]):
+        if not user_ids:
+            return
+        if bot.redis:
+            await bot.redis.sadd(self._key(giveaway_id), *user_ids)
+            return
+        rows = [{"giveaway_id": giveaway_id, "user_id": uid} for uid in user_ids]
+        for i in range(0, len(rows), 1000):
+            await db.table("giveaway_entries").upsert(rows[i:i + 1000], on_conflict="giveaway_id,user_id", ignore_duplicates=True).execute()
+
+    async def count(self, giveaway_id: int, exact: bool = True) -> int:
+        """With exact=False (the live display on every click) the table fallback
+        asks PostgREST for an "estimated" count: exact while small, the
+        planner's estimate once large, instead of a full count per click."""
+        if bot.redis:
+            return await bot.redis.scard(self._key(giveaway_id))
+        method = "exact" if exact else "estimated"
+        res = await db.table("giveaway_entries").select("user_id", count=method).eq("giveaway_id", giveaway_id).limit(1).execute()
+        return res.count or 0
+
+    async def sample(self, giveaway_id: int, k: int) -> list[int]:
+        """Up to `k` distinct random entrants."""
+        if k <= 0:
+            return []
+        if bot.redis:
+            return [int(uid) for uid in await bot.redis.srandmember(self._key(giveaway_id), k)]
+        total = await self.count(giveaway_id)
+        winners = []
+        for offset in random.sample(range(total), min(k, total)):
+            res = await db.table("giveaway_entries").select("user_id").eq("giveaway_id", giveaway_id).order("user_id").range(offset, offset).execute()
+            winners.extend(r["user_id"] for r in res.data)
+        return winners
+
+    async def retire(self, giveaway_id: int):
+        if bot.redis:
+            await bot.redis.expire(self._key(giveaway_id), GIVEAWAY_ENTRIES_RETENTION)
+
+
+giveaway_entries = GiveawayEntryStore()
+
+
+async def import_legacy_entrants(giveaway: dict):
+    """Move entrants from the old JSON `entrants` column into the entry store."""
+    legacy = json.loads(giveaway.get("entrants") or "[]")
+    if not legacy:
+        return
+    await giveaway_entries.add_many(giveaway["id"], legacy)
+    await db.table("giveaways").update({"entrants": "[]"}).eq("id", giveaway["id"]).execute()
+    giveaway["entrants"] = "[]"
+
+
 class GiveawayView(discord.ui.View):
     def __init__(self, giveaway_id: int):
         super().__init__(timeout=None)
@@ -1328,7 +2817,7 @@ class GiveawayView(discord.ui.View):
 
     @discord.ui.button(label="🎉 Enter Giveaway", style=discord.ButtonStyle.green, custom_id="vantix_giveaway_enter")
     async def enter(self, interaction: discord.Interaction, button: discord.ui.Button):
-        res = supabase.table("giveaways").select("*").eq("id", self.giveaway_id).execute()
+        res = await db.table("giveaways").select("status,required_role").eq("id", self.giveaway_id).execute()
         if not res.data or res.data[0]["status"] != "active":
             return await interaction.response.send_message("This giveaway has ended.", ephemeral=True)
         giveaway = res.data[0]
@@ -1337,15 +2826,9 @@ class GiveawayView(discord.ui.View):
             if int(giveaway["required_role"]) not in [r.id for r in interaction.user.roles]:
                 return await interaction.response.send_message("You don't have the required role to enter.", ephemeral=True)
 
-        entrants = set(json.loads(giveaway.get("entrants") or "[]"))
-        if interaction.user.id in entrants:
-            entrants.discard(interaction.user.id)
-            msg = "You left the giveaway."
-        else:
-            entrants.add(interaction.user.id)
-            msg = "You entered the giveaway! 🎉"
-        supabase.table("giveaways").update({"entrants": json.dumps(list(entrants))}).eq("id", self.giveaway_id).execute()
-        await interaction.response.send_message(msg, ephemeral=True)
+        entered, count = await giveaway_entries.toggle(self.giveaway_id, interaction.user.id)
+        msg = "You entered the giveaway! 🎉" if entered else "You left the giveaway."
+        await interaction.response.send_message(f"{msg} ({count:,} entrants)", ephemeral=True)
 
 
 @bot.tree.command(name="gcreate", description="Create a giveaway")
@@ -1366,77 +2849,159 @@ async def gcreate_cmd(interaction: discord.Interaction, prize: str, duration: st
         "prize": prize, "winners": winners, "required_role": required_role.id if required_role else None,
         "entrants": "[]", "status": "active", "end_time": end_time.isoformat(),
     }
-    res = supabase.table("giveaways").insert(data).execute()
+    res = await db.table("giveaways").insert(data).execute()
     giveaway_id = res.data[0]["id"]
+    giveaway_scheduler.schedule(giveaway_id, end_time.timestamp())
     await msg.edit(view=GiveawayView(giveaway_id))
     await interaction.response.send_message(embed=make_embed("✅ Giveaway Created", f"Giveaway posted in {channel.mention}.", discord.Color.green(), bot.user), ephemeral=True)
 
 
-async def end_giveaway(giveaway: dict):
-    guild = bot.get_guild(giveaway["guild_id"])
-    if not guild:
-        return
-    channel = guild.get_channel(giveaway["channel_id"])
-    entrants = json.loads(giveaway.get("entrants") or "[]")
-    import random
-    winners_count = min(giveaway["winners"], len(entrants))
-    winners = random.sample(entrants, winners_count) if entrants else []
+GIVEAWAY_RETRY_SECONDS = 60
 
-    supabase.table("giveaways").update({"status": "ended"}).eq("id", giveaway["id"]).execute()
 
-    if not winners:
-        result = "No valid entrants — no winner could be selected."
-    else:
-        result = ", ".join(f"<@{w}>" for w in winners)
+async def claim_giveaway(column: str, value) -> Optional[dict]:
+    """Atomically flip an active giveaway to ending. The conditional update only
+    matches while the row is still active, so exactly one caller (across all
+    processes) gets the row back and goes on to announce winners. The row stays
+    "ending" until end_giveaway has announced, so a failed draw is retried by
+    the scheduler instead of leaving an ended giveaway without winners."""
+    res = await db.table("giveaways").update({"status": "ending"}).eq(column, value).eq("status", "active").execute()
+    if not res.data:
+        return None
+    giveaway_scheduler.cancel(res.data[0]["id"])
+    return res.data[0]
 
-    embed = make_embed(f"🎉 Giveaway Ended: {giveaway['prize']}", f"Winner(s): {result}", discord.Color.gold(), bot.user)
-    if channel:
-        await channel.send(embed=embed)
+
+async def end_giveaway(giveaway: dict):
+    """Draw and announce winners for a giveaway already claimed via claim_giveaway,
+    then mark it ended. Safe to call again on a row still "ending": the drawn
+    winner_ids are saved before announcing and reused on a retry, and once
+    announcement_id is set the announcement isn't sent again."""
+    guild = bot.get_guild(giveaway["guild_id"])
+    channel = guild.get_channel(giveaway["channel_id"]) if guild else None
+    update = {"status": "ended"}
+    if guild and not giveaway.get("announcement_id"):
+        if giveaway.get("winner_ids") is None:
+            await import_legacy_entrants(giveaway)
+            winners = await giveaway_entries.sample(giveaway["id"], giveaway["winners"])
+            await db.table("giveaways").update({"winner_ids": json.dumps(winners)}).eq("id", giveaway["id"]).eq("status", "ending").execute()
+            giveaway["winner_ids"] = json.dumps(winners)
+        winners = json.loads(giveaway["winner_ids"])
+        await giveaway_entries.retire(giveaway["id"])
+
+        if not winners:
+            result = "No valid entrants — no winner could be selected."
+        else:
+            result = ", ".join(f"<@{w}>" for w in winners)
+
+        embed = make_embed(f"🎉 Giveaway Ended: {giveaway['prize']}", f"Winner(s): {result}", discord.Color.gold(), bot.user)
+        if channel:
+            message = await channel.send(embed=embed)
+            update["announcement_id"] = message.id
+    await db.table("giveaways").update(update).eq("id", giveaway["id"]).eq("status", "ending").execute()
 
 
 @bot.tree.command(name="gend", description="End a giveaway early")
 @has_mod_perms()
 async def gend_cmd(interaction: discord.Interaction, message_id: str):
-    res = supabase.table("giveaways").select("*").eq("message_id", int(message_id)).eq("status", "active").execute()
-    if not res.data:
+    giveaway = await claim_giveaway("message_id", int(message_id))
+    if not giveaway:
         return await interaction.response.send_message(embed=make_embed("❌ Error", "Active giveaway not found.", discord.Color.red(), bot.user), ephemeral=True)
-    await end_giveaway(res.data[0])
+    try:
+        await end_giveaway(giveaway)
+    except Exception as e:
+        logger.error(f"gend error: {e}")
+        giveaway_scheduler.schedule(giveaway["id"], time.time() + GIVEAWAY_RETRY_SECONDS)
+        return await interaction.response.send_message(embed=make_embed("⚠️ Giveaway Ending", "Winners couldn't be announced right now; it will be retried shortly.", discord.Color.orange(), bot.user), ephemeral=True)
     await interaction.response.send_message(embed=make_embed("✅ Giveaway Ended", "The giveaway has been ended.", discord.Color.green(), bot.user), ephemeral=True)
 
 
 @bot.tree.command(name="greroll", description="Reroll a giveaway winner")
 @has_mod_perms()
 async def greroll_cmd(interaction: discord.Interaction, message_id: str):
-    res = supabase.table("giveaways").select("*").eq("message_id", int(message_id)).execute()
+    res = await db.table("giveaways").select("*").eq("message_id", int(message_id)).execute()
     if not res.data:
         return await interaction.response.send_message(embed=make_embed("❌ Error", "Giveaway not found.", discord.Color.red(), bot.user), ephemeral=True)
     giveaway = res.data[0]
-    entrants = json.loads(giveaway.get("entrants") or "[]")
-    if not entrants:
+    await import_legacy_entrants(giveaway)
+    picked = await giveaway_entries.sample(giveaway["id"], 1)
+    if not picked:
         return await interaction.response.send_message(embed=make_embed("❌ Error", "No entrants to reroll.", discord.Color.red(), bot.user), ephemeral=True)
-    import random
-    new_winner = random.choice(entrants)
-    await interaction.response.send_message(embed=make_embed("🎉 Giveaway Rerolled", f"New winner: <@{new_winner}>", discord.Color.gold(), bot.user))
+    await interaction.response.send_message(embed=make_embed("🎉 Giveaway Rerolled", f"New winner: <@{picked[0]}>", discord.Color.gold(), bot.user))
 
 
 @bot.tree.command(name="glist", description="List active giveaways")
 async def glist_cmd(interaction: discord.Interaction):
-    res = supabase.table("giveaways").select("*").eq("guild_id", interaction.guild_id).eq("status", "active").execute()
+    res = await db.table("giveaways").select("*").eq("guild_id", interaction.guild_id).eq("status", "active").execute()
     if not res.data:
         return await interaction.response.send_message(embed=make_embed("🎉 Active Giveaways", "None currently active.", discord.Color.blurple(), bot.user))
     desc = "\n".join(f"**{g['prize']}** — ends <t:{int(datetime.datetime.fromisoformat(g['end_time']).timestamp())}:R>" for g in res.data)
     await interaction.response.send_message(embed=make_embed("🎉 Active Giveaways", desc, discord.Color.gold(), bot.user))
 
 
-@tasks.loop(seconds=30)
-async def giveaway_checker():
-    try:
-        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
-        res = supabase.table("giveaways").select("*").eq("status", "active").lte("end_time", now).execute()
-        for giveaway in res.data:
-            await end_giveaway(giveaway)
-    except Exception as e:
-        logger.error(f"giveaway_checker error: {e}")
+class GiveawayScheduler:
+    """Min-heap of (end_time, giveaway_id) with a single task that sleeps until
+    the earliest deadline (or until an earlier one is scheduled). Cancelled or
+    rescheduled giveaways leave stale heap entries that are skipped on pop."""
+
+    def __init__(self):
+        self.heap: list[tuple[float, int]] = []
+        self.deadlines: dict[int, float] = {}
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def schedule(self, giveaway_id: int, end_ts: float):
+        self.deadlines[giveaway_id] = end_ts
+        heapq.heappush(self.heap, (end_ts, giveaway_id))
+        self.wakeup.set()
+
+    def cancel(self, giveaway_id: int):
+        self.deadlines.pop(giveaway_id, None)
+
+    async def start(self):
+        """Load this process's active giveaways once and start the timer task."""
+        if self.task is not None:
+            return
+        res = await db.table("giveaways").select("id,guild_id,end_time,status").in_("status", ["active", "ending"]).execute()
+        for g in res.data:
+            if bot.get_guild(g["guild_id"]):
+                # "ending" rows were claimed but never announced (failure or restart)
+                due = datetime.datetime.fromisoformat(g["end_time"]).timestamp() if g["status"] == "active" else time.time()
+                self.schedule(g["id"], due)
+        logger.info(f"Scheduled {len(self.deadlines)} active giveaways.")
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            self.wakeup.clear()
+            while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, giveaway_id = heapq.heappop(self.heap)
+            self.deadlines.pop(giveaway_id, None)
+            asyncio.create_task(self._fire(giveaway_id))
+
+    async def _fire(self, giveaway_id: int):
+        try:
+            giveaway = await claim_giveaway("id", giveaway_id)
+            if giveaway is None:
+                # already claimed: resume it if it's stuck in "ending" (a retry)
+                res = await db.table("giveaways").select("*").eq("id", giveaway_id).eq("status", "ending").execute()
+                giveaway = res.data[0] if res.data else None
+            if giveaway:
+                await end_giveaway(giveaway)
+        except Exception as e:
+            logger.error(f"giveaway scheduler error: {e}")
+            self.schedule(giveaway_id, time.time() + GIVEAWAY_RETRY_SECONDS)
+
+
+giveaway_scheduler = GiveawayScheduler()
 
 
 # ==================================================================
@@ -1490,17 +3055,24 @@ async def membercountset_cmd(interaction: discord.Interaction, channel: discord.
     await interaction.response.send_message(embed=make_embed("👥 Member Count", f"Live count channel set to {channel.mention}.", discord.Color.green(), bot.user))
 
 
+MEMBERCOUNT_RENAME_INTERVAL = 300  # Discord allows ~2 renames per channel per 10 minutes
+
+
 async def update_membercount_channel(guild: discord.Guild):
     cfg = await get_guild_config(guild.id)
     channel_id = cfg.get("membercount_channel")
     if not channel_id:
         return
     channel = guild.get_channel(int(channel_id))
-    if channel:
-        try:
-            await channel.edit(name=f"Members: {guild.member_count:,}")
-        except discord.HTTPException:
-            pass
+    if not channel:
+        return
+
+    async def rename():
+        name = f"Members: {guild.member_count:,}"
+        if channel.name != name:
+            await channel.edit(name=name)
+
+    channel_editor.submit(channel.id, rename, MEMBERCOUNT_RENAME_INTERVAL)
 
 
 # ==================================================================
@@ -1523,6 +3095,16 @@ async def botstats_cmd(interaction: discord.Interaction):
     embed.add_field(name="Memory Usage", value=f"{mem_mb:.1f} MB", inline=True)
     embed.add_field(name="discord.py", value=discord.__version__, inline=True)
     embed.add_field(name="Commands Executed", value=str(bot.commands_executed), inline=True)
+    dbs = db.summary()
+    embed.add_field(name="DB Calls", value=f"{dbs['calls']} ({dbs['errors']} errors)", inline=True)
+    embed.add_field(name="DB Latency", value=f"avg {dbs['avg_ms']:.0f}ms / max {dbs['max_ms']:.0f}ms", inline=True)
+    embed.add_field(name="DB Queue", value=f"{dbs['in_flight']} running / {dbs['queued']} waiting", inline=True)
+    embed.add_field(name="Config Cache", value=bot.guild_config_local.summary(), inline=True)
+    embed.add_field(name="HTTP Pool", value=bot.http_stats.summary(), inline=True)
+    embed.add_field(name="AI Responses", value=bot.ai_stats.summary(), inline=True)
+    embed.add_field(name="Channel Edits", value=f"{channel_editor.applied} applied / {channel_editor.coalesced} coalesced", inline=True)
+    embed.add_field(name="Anti-Spam", value=bot.antispam_tracker.summary(), inline=True)
+    embed.add_field(name="Message Pipeline", value=bot.message_pipeline.summary()[:1024], inline=False)
     await interaction.response.send_message(embed=embed)
 
 
@@ -1536,83 +3118,344 @@ async def statusmonitor_cmd(interaction: discord.Interaction, channel: discord.T
     """`port` is optional — omit it to monitor plain host reachability (HTTP HEAD /
     socket probe on common ports) instead of a specific TCP port.
     Posts one status message and edits that same message every minute (no channel rename)."""
-    supabase.table("status_monitor_config").upsert({
+    await db.table("status_monitor_config").upsert({
         "guild_id": interaction.guild_id, "channel_id": channel.id, "address": address, "port": port, "message_id": None
     }, on_conflict="guild_id,channel_id").execute()
     target_desc = f"`{address}:{port}`" if port else f"`{address}` (host reachability only)"
     await interaction.response.send_message(embed=make_embed("📡 Status Monitor", f"Monitoring {target_desc} → {channel.mention}", discord.Color.green(), bot.user))
 
 
-async def check_host(address: str, port: Optional[int] = None, timeout: float = 3.0) -> bool:
-    """If a port is given, does a TCP connect check on that exact port.
-    If no port is given, falls back to an HTTP HEAD request (covers web
-    services) and, failing that, a raw TCP probe on common ports (80/443)
-    as a best-effort 'is this host up at all' check."""
-    if port:
+# Every tick probes each distinct address:port once, however many guilds
+# monitor it, with bounded concurrency over the shared HTTP session and a small
+# DNS cache for the raw TCP probes. Probes still running when the tick's time
+# budget runs out are cancelled and that target's state is left as it was for
+# this tick, so a tick never overruns its interval.
+STATUS_MONITOR_INTERVAL = 60
+STATUS_PROBE_CONCURRENCY = 64
+STATUS_TICK_BUDGET = 45        # seconds a tick may spend probing
+STATUS_DNS_TTL = 300
+
+
+class StatusProber:
+    def __init__(self, concurrency: int, dns_ttl: float):
+        self.limit = asyncio.Semaphore(concurrency)
+        self.dns_ttl = dns_ttl
+        self._dns: dict[str, tuple[float, str]] = {}  # host -> (expires_at, ip)
+        self.last_result: dict[tuple[str, Optional[int]], float] = {}  # target -> when it last got a result
+
+    async def resolve(self, host: str) -> str:
+        cached = self._dns.get(host)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        ip = infos[0][4][0]
+        self._dns[host] = (time.monotonic() + self.dns_ttl, ip)
+        return ip
+
+    async def check_host(self, address: str, port: Optional[int] = None, timeout: float = 3.0) -> Optional[float]:
+        """Returns the round-trip time in milliseconds, or None if the host is down.
+        If a port is given, does a TCP connect check on that exact port.
+        If no port is given, falls back to an HTTP HEAD request (covers web
+        services) and, failing that, a raw TCP probe on common ports (80/443)
+        as a best-effort 'is this host up at all' check."""
+        if port:
+            try:
+                host = await asyncio.wait_for(self.resolve(address), timeout=timeout)
+                started = time.perf_counter()
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+                latency = (time.perf_counter() - started) * 1000
+                writer.close()
+                await writer.wait_closed()
+                return latency
+            except Exception:
+                return None
+
+        # No port specified: try HTTP(S) first, then common ports as a fallback.
+        url = address if address.startswith(("http://", "https://")) else f"https://{address}"
         try:
-            conn = asyncio.open_connection(address, port)
-            reader, writer = await asyncio.wait_for(conn, timeout=timeout)
-            writer.close()
-            await writer.wait_closed()
-            return True
+            started = time.perf_counter()
+            async with get_http_session().head(url, timeout=aiohttp.ClientTimeout(total=timeout), allow_redirects=True) as resp:
+                return (time.perf_counter() - started) * 1000 if resp.status < 500 else None
         except Exception:
-            return False
+            for fallback_port in (443, 80):
+                latency = await self.check_host(address, fallback_port, timeout)
+                if latency is not None:
+                    return latency
+            return None
+
+    async def _probe(self, address: str, port: Optional[int]) -> Optional[float]:
+        async with self.limit:
+            return await self.check_host(address, port)
+
+    async def probe_all(self, targets: set[tuple[str, Optional[int]]], budget: float) -> dict[tuple[str, Optional[int]], Optional[float]]:
+        """Latency per target in ms, None for targets that are down. Targets whose
+        probe didn't finish within the budget (usually still queued behind slow
+        ones) are left out: their state is unknown, not offline."""
+        if not targets:
+            return {}
+        # Stalest first: the semaphore admits waiters in order, so targets cut
+        # off last tick (or never probed) get slots before the rest.
+        ordered = sorted(targets, key=lambda t: self.last_result.get(t, 0.0))
+        tasks_by_target = {t: asyncio.create_task(self._probe(*t)) for t in ordered}
+        await asyncio.wait(tasks_by_target.values(), timeout=budget)
+        results = {}
+        now = time.monotonic()
+        for target, task in tasks_by_target.items():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                results[target] = task.result() if task.exception() is None else None
+                self.last_result[target] = now
+        for target in list(self.last_result):
+            if target not in targets:
+                del self.last_result[target]
+        return results
+
+
+status_prober = StatusProber(STATUS_PROBE_CONCURRENCY, STATUS_DNS_TTL)
+
+
+# Per-target history lives in fixed-size arrays: hourly up/total counters for
+# the last 7 days and an hourly log-scale latency histogram for the last 24h.
+# Window sums are maintained as hours roll over (the expiring bucket is
+# subtracted), so uptime and percentiles never rescan history. Each closed hour
+# becomes one status_history row (target, hour, up, total, latency).
+STATUS_HISTORY_HOURS = 168
+STATUS_LATENCY_HOURS = 24
+STATUS_LATENCY_BINS = 32
+STATUS_LATENCY_RATIO = 1.35    # bin i covers [1.35^i, 1.35^(i+1)) ms, ~15s at the top
+STATUS_STATS_REFRESH_SECONDS = 600
+
+
+def _latency_bin(latency_ms: float) -> int:
+    if latency_ms <= 1:
+        return 0
+    return min(STATUS_LATENCY_BINS - 1, int(math.log(latency_ms) / math.log(STATUS_LATENCY_RATIO)))
+
+
+class HostHistory:
+    __slots__ = ("hour", "up", "total", "latency", "up_24h", "total_24h", "up_7d", "total_7d", "latency_24h")
+
+    def __init__(self, hour: int):
+        self.hour = hour
+        self.up = array("H", [0]) * STATUS_HISTORY_HOURS
+        self.total = array("H", [0]) * STATUS_HISTORY_HOURS
+        self.latency = array("H", [0]) * (STATUS_LATENCY_HOURS * STATUS_LATENCY_BINS)
+        self.latency_24h = array("I", [0]) * STATUS_LATENCY_BINS
+        self.up_24h = self.total_24h = self.up_7d = self.total_7d = 0
+
+    def _add(self, hour: int, up: int, total: int, latency_bins):
+        slot = hour % STATUS_HISTORY_HOURS
+        self.up[slot] += up
+        self.total[slot] += total
+        self.up_7d += up
+        self.total_7d += total
+        if hour > self.hour - STATUS_LATENCY_HOURS:
+            self.up_24h += up
+            self.total_24h += total
+            base = (hour % STATUS_LATENCY_HOURS) * STATUS_LATENCY_BINS
+            for i, n in enumerate(latency_bins):
+                if n:
+                    self.latency[base + i] += n
+                    self.latency_24h[i] += n
+
+    def row(self, hour: int) -> dict:
+        slot = hour % STATUS_HISTORY_HOURS
+        base = (hour % STATUS_LATENCY_HOURS) * STATUS_LATENCY_BINS
+        return {"hour": hour, "up": self.up[slot], "total": self.total[slot],
+                "latency": list(self.latency[base:base + STATUS_LATENCY_BINS])}
+
+    def _advance(self, hour: int) -> Optional[dict]:
+        """Moves the current hour forward, expiring buckets that fall out of
+        either window. Returns the just-closed hour's row if it had samples."""
+        if hour <= self.hour:
+            return None
+        closed = self.row(self.hour) if self.total[self.hour % STATUS_HISTORY_HOURS] else None
+        if hour - self.hour >= STATUS_HISTORY_HOURS:
+            self.__init__(hour)
+            return closed
+        while self.hour < hour:
+            self.hour += 1
+            expired_24h = (self.hour - STATUS_LATENCY_HOURS) % STATUS_HISTORY_HOURS
+            self.up_24h -= self.up[expired_24h]
+            self.total_24h -= self.total[expired_24h]
+            base = (self.hour % STATUS_LATENCY_HOURS) * STATUS_LATENCY_BINS
+            for i in range(STATUS_LATENCY_BINS):
+                self.latency_24h[i] -= self.latency[base + i]
+                self.latency[base + i] = 0
+            slot = self.hour % STATUS_HISTORY_HOURS
+            self.up_7d -= self.up[slot]
+            self.total_7d -= self.total[slot]
+            self.up[slot] = self.total[slot] = 0
+        return closed
+
+    def record(self, now: float, latency_ms: Optional[float]) -> Optional[dict]:
+        closed = self._advance(int(now // 3600))
+        bins = [0] * STATUS_LATENCY_BINS
+        if latency_ms is not None:
+            bins[_latency_bin(latency_ms)] = 1
+        self._add(self.hour, 1 if latency_ms is not None else 0, 1, bins)
+        return closed
+
+    def load(self, row: dict):
+        hour = row["hour"]
+        if self.hour - STATUS_HISTORY_HOURS < hour <= self.hour:
+            self._add(hour, row["up"], row["total"], row.get("latency") or ())
+
+    def uptime(self, hours: int) -> Optional[float]:
+        up, total = (self.up_24h, self.total_24h) if hours == 24 else (self.up_7d, self.total_7d)
+        return up / total * 100 if total else None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Geometric midpoint of the 24h histogram bin holding the q-th sample, in ms."""
+        count = sum(self.latency_24h)
+        if not count:
+            return None
+        rank, seen = q * count, 0
+        for i, n in enumerate(self.latency_24h):
+            seen += n
+            if seen >= rank:
+                return STATUS_LATENCY_RATIO ** (i + 0.5)
+        return STATUS_LATENCY_RATIO ** (STATUS_LATENCY_BINS - 0.5)
+
+
+def status_target_key(address: str, port: Optional[int]) -> str:
+    return f"{address}:{port}" if port else address
+
+
+class StatusHistory:
+    def __init__(self):
+        self.hosts: dict[str, HostHistory] = {}
+        self.pending: dict[tuple[str, int], dict] = {}  # (target, hour) -> row awaiting flush
+
+    async def ensure(self, targets: list[str]):
+        """Creates histories for new targets, seeded from status_history."""
+        missing = [t for t in targets if t not in self.hosts]
+        if not missing:
+            return
+        hour = int(time.time() // 3600)
+        for target in missing:
+            self.hosts[target] = HostHistory(hour)
+        try:
+            for i in range(0, len(missing), 100):
+                res = await db.table("status_history").select("target,hour,up,total,latency") \
+                    .in_("target", missing[i:i + 100]).gt("hour", hour - STATUS_HISTORY_HOURS).execute()
+                for row in res.data:
+                    self.hosts[row["target"]].load(row)
+        except Exception as e:
+            logger.error(f"status history load error: {e}")
+
+    def record(self, target: str, latency_ms: Optional[float]) -> HostHistory:
+        history = self.hosts[target]
+        closed = history.record(time.time(), latency_ms)
+        if closed:
+            self.pending[(target, closed["hour"])] = {"target": target, **closed}
+        return history
+
+    def prune(self, targets: set[str]):
+        for target in list(self.hosts):
+            if target not in targets:
+                del self.hosts[target]
+
+    async def flush(self, include_open: bool = False):
+        if include_open:
+            for target, history in self.hosts.items():
+                if history.total[history.hour % STATUS_HISTORY_HOURS]:
+                    self.pending[(target, history.hour)] = {"target": target, **history.row(history.hour)}
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        rows = list(batch.values())
+        try:
+            for i in range(0, len(rows), 500):
+                await db.table("status_history").upsert(rows[i:i + 500], on_conflict="target,hour").execute()
+        except Exception as e:
+            logger.error(f"status history flush error: {e}")
+            for key, row in batch.items():
+                self.pending.setdefault(key, row)
+
+
+status_history = StatusHistory()
+bot.status_monitor_state: dict[int, tuple[bool, int, float]] = {}  # config id -> (online, since, last edit)
+
+
+def format_status_stats(history: HostHistory) -> str:
+    def pct(value):
+        return f"{value:.2f}%" if value is not None else "n/a"
+
+    def ms(value):
+        return f"{value:.0f} ms" if value is not None else "n/a"
+
+    return (f"Uptime: 24h `{pct(history.uptime(24))}` · 7d `{pct(history.uptime(168))}`\n"
+            f"Latency (24h): p50 `{ms(history.percentile(0.5))}` · p95 `{ms(history.percentile(0.95))}`")
 
-    # No port specified: try HTTP(S) first, then common ports as a fallback.
-    url = address if address.startswith(("http://", "https://")) else f"https://{address}"
+
+STATUS_EDIT_INTERVAL = 5
+
+
+async def publish_status(cfg: dict, channel: discord.abc.Messageable, embed: discord.Embed):
+    """Edit the monitor's status message, or post a new one if it's gone."""
+    message_id = cfg.get("message_id")
+    if message_id:
+        try:
+            await channel.get_partial_message(int(message_id)).edit(embed=embed)
+            return
+        except discord.NotFound:
+            pass
+        except discord.HTTPException:
+            return
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.head(url, timeout=aiohttp.ClientTimeout(total=timeout), allow_redirects=True) as resp:
-                return resp.status < 500
-    except Exception:
-        for fallback_port in (443, 80):
-            if await check_host(address, fallback_port, timeout):
-                return True
-        return False
+        new_message = await channel.send(embed=embed)
+        await db.table("status_monitor_config").update({"message_id": new_message.id}).eq("id", cfg["id"]).execute()
+    except discord.HTTPException:
+        pass
 
 
-@tasks.loop(seconds=60)
+@tasks.loop(seconds=STATUS_MONITOR_INTERVAL)
 async def status_monitor_loop():
     try:
-        res = supabase.table("status_monitor_config").select("*").execute()
+        res = await db.table("status_monitor_config").select("*").execute()
+        monitors = []
         for cfg in res.data:
             guild = bot.get_guild(cfg["guild_id"])
-            if not guild:
-                continue
-            channel = guild.get_channel(cfg["channel_id"])
-            if not channel:
-                continue
+            channel = guild.get_channel(cfg["channel_id"]) if guild else None
+            if channel:
+                monitors.append((cfg, channel))
+
+        targets = {(cfg["address"], cfg.get("port")) for cfg, _ in monitors}
+        keys = {status_target_key(*t) for t in targets}
+        status_history.prune(keys)
+        await status_history.ensure(list(keys))
+        results = await status_prober.probe_all(targets, STATUS_TICK_BUDGET)
+        histories = {status_target_key(*t): status_history.record(status_target_key(*t), latency) for t, latency in results.items()}
+
+        now = time.time()
+        for cfg, channel in monitors:
             port = cfg.get("port")
-            online = await check_host(cfg["address"], port)
+            if (cfg["address"], port) not in results:
+                continue  # not probed within the budget: keep the previous state
+            online = results[(cfg["address"], port)] is not None
+            history = histories[status_target_key(cfg["address"], port)]
+            previous = bot.status_monitor_state.get(cfg["id"])
+            if (previous is not None and previous[0] == online and cfg.get("message_id")
+                    and now - previous[2] < STATUS_STATS_REFRESH_SECONDS):
+                continue  # unchanged state and the stats were refreshed recently
+            since = previous[1] if previous is not None and previous[0] == online else int(now)
+            bot.status_monitor_state[cfg["id"]] = (online, since, now)
+
             status_icon = "🟢" if online else "🔴"
             port_label = f" | Port: {port}" if port else ""
             target_desc = f"{cfg['address']}{(':' + str(port)) if port else ''}"
             embed = make_embed(
                 "📡 Status Monitor",
-                f"{status_icon} **{'Online' if online else 'Offline'}**\nTarget: `{target_desc}`{port_label}\nLast checked: <t:{int(time.time())}:R>",
+                f"{status_icon} **{'Online' if online else 'Offline'}**\nTarget: `{target_desc}`{port_label}\nSince: <t:{since}:R>\n{format_status_stats(history)}",
                 discord.Color.green() if online else discord.Color.red(),
                 bot.user,
             )
 
-            message_id = cfg.get("message_id")
-            message = None
-            if message_id:
-                try:
-                    message = await channel.fetch_message(int(message_id))
-                except (discord.NotFound, discord.HTTPException):
-                    message = None
+            channel_editor.submit(("status", cfg["id"]), functools.partial(publish_status, cfg, channel, embed), STATUS_EDIT_INTERVAL)
 
-            if message:
-                try:
-                    await message.edit(embed=embed)
-                except discord.HTTPException:
-                    pass
-            else:
-                try:
-                    new_message = await channel.send(embed=embed)
-                    supabase.table("status_monitor_config").update({"message_id": new_message.id}).eq("id", cfg["id"]).execute()
-                except discord.HTTPException:
-                    pass
+        await status_history.flush()
     except Exception as e:
         logger.error(f"status_monitor_loop error: {e}")
 
@@ -1626,6 +3469,109 @@ SYSTEM_PROMPT = (
     "Keep responses concise, clear, and useful. You were developed by AashirwadGamerzz."
 )
 
+# Answers are streamed (SSE) and shown progressively. Edits are coalesced to
+# one per AI_EDIT_INTERVAL; text past the embed limit continues in a new
+# followup. Time to first visible token (deferral -> first edit carrying
+# text) is sampled for /botstats.
+AI_EDIT_INTERVAL = 1.0
+AI_EMBED_LIMIT = 4000
+AI_STREAM_TIMEOUT = aiohttp.ClientTimeout(total=180, sock_read=30)
+
+
+class _AiStats:
+    def __init__(self, samples: int = 200):
+        self.requests = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.ttft = deque(maxlen=samples)  # seconds, most recent streamed answers
+
+    def summary(self) -> str:
+        hit_rate = 100 * self.cache_hits / self.requests if self.requests else 0.0
+        counts = f"{self.requests} requests ({self.errors} errors), cache {hit_rate:.1f}% hit"
+        if not self.ttft:
+            return counts
+        ordered = sorted(self.ttft)
+        p50 = ordered[len(ordered) // 2]
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return f"TTFT p50 {p50 * 1000:.0f}ms / p95 {p95 * 1000:.0f}ms\n{counts}"
+
+
+bot.ai_stats = _AiStats()
+
+# Completed answers are cached under a hash of everything the model saw
+# (model, system prompt, context window, question), normalized for case and
+# whitespace so trivially different phrasings of an FAQ share an entry. The
+# first tier is process-local; with Redis a second tier is shared by all shards.
+AI_CACHE_TTL = 6 * 3600
+AI_CACHE_LOCAL_SIZE = 2000
+bot.ai_response_local = LocalLRUCache(AI_CACHE_LOCAL_SIZE, AI_CACHE_TTL)
+
+
+def _normalize_prompt(text: str) -> str:
+    return " ".join(text.lower().split()).rstrip("?!. ")
+
+
+def ai_cache_key(messages: list[dict]) -> str:
+    normalized = [[m["role"], _normalize_prompt(m["content"])] for m in messages]
+    raw = json.dumps([OPENROUTER_MODEL, normalized], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def ai_cache_get(key: str) -> Optional[str]:
+    answer = bot.ai_response_local.get(key)
+    if answer is None and bot.redis:
+        try:
+            answer = await cache_get("ai_response_cache", key)
+        except Exception as e:
+            logger.error(f"AI cache read error: {e}")
+        if answer is not None:
+            bot.ai_response_local.set(key, answer)
+    return answer
+
+
+async def ai_cache_set(key: str, answer: str):
+    bot.ai_response_local.set(key, answer)
+    if bot.redis:
+        try:
+            await cache_set("ai_response_cache", key, answer, ttl=AI_CACHE_TTL)
+        except Exception as e:
+            logger.error(f"AI cache write error: {e}")
+
+
+async def stream_openrouter(messages: list[dict]):
+    """Yields content deltas of a streamed chat completion."""
+    async with get_http_session().post(
+        "https://openrouter.ai/api/v1/chat/completions",
+        headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"},
+        json={"model": OPENROUTER_MODEL, "messages": messages, "stream": True},
+        timeout=AI_STREAM_TIMEOUT,
+    ) as resp:
+        if resp.status != 200:
+            raise RuntimeError(f"OpenRouter returned {resp.status}")
+        async for raw in resp.content:
+            line = raw.decode("utf-8", "replace").strip()
+            if not line.startswith("data:"):
+                continue  # blank separators and ": keep-alive" comments
+            data = line[5:].strip()
+            if data == "[DONE]":
+                return
+            chunk = json.loads(data)
+            if "error" in chunk:
+                raise RuntimeError(f"OpenRouter stream error: {chunk['error']}")
+            choices = chunk.get("choices") or [{}]
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta:
+                yield delta
+
+
+def _split_point(text: str, limit: int) -> int:
+    """Where to break an overflowing answer: last newline, else last space, in the second half."""
+    for sep in ("\n", " "):
+        cut = text.rfind(sep, limit // 2, limit)
+        if cut != -1:
+            return cut + 1
+    return limit
+
 
 @bot.tree.command(name="ask", description="Ask the VantixNodes AI a question")
 @app_commands.checks.cooldown(1, 10.0)
@@ -1639,27 +3585,67 @@ async def ask_cmd(interaction: discord.Interaction, question: str):
     context[:] = context[-10:]  # keep last 10 messages
 
     messages = [{"role": "system", "content": SYSTEM_PROMPT}] + context
+    started = time.perf_counter()
+    bot.ai_stats.requests += 1
+    cache_key = ai_cache_key(messages)
+    cached = await ai_cache_get(cache_key)
+
+    answer = ""
+    page_start = 0        # offset in answer where the message being edited starts
+    current = None        # overflow followup being edited; None = the original response
+    last_edit = 0.0
+    visible = False
+
+    async def show(text: str, final: bool):
+        embed = make_embed("🤖 VantixNodes AI", (text if final else text + " ▌") or "*No response.*", discord.Color.purple(), bot.user)
+        embed.set_footer(text=f"{BOT_NAME} • Asked by {interaction.user}", icon_url=bot.user.display_avatar.url)
+        if current is None:
+            await interaction.edit_original_response(embed=embed)
+        else:
+            await current.edit(embed=embed)
+
+    async def overflow(text: str):
+        """Finalizes full pages and moves editing on to a new followup."""
+        nonlocal page_start, current
+        while len(text) - page_start > AI_EMBED_LIMIT:
+            cut = page_start + _split_point(text[page_start:], AI_EMBED_LIMIT)
+            await show(text[page_start:cut], final=True)
+            page_start = cut
+            current = await interaction.followup.send(embed=make_embed("🤖 VantixNodes AI", "…", discord.Color.purple(), bot.user), wait=True)
+
+    if cached is not None:
+        bot.ai_stats.cache_hits += 1
+        await overflow(cached)
+        await show(cached[page_start:], final=True)
+        context.append({"role": "assistant", "content": cached})
+        return
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"},
-                json={"model": OPENROUTER_MODEL, "messages": messages},
-                timeout=aiohttp.ClientTimeout(total=30),
-            ) as resp:
-                if resp.status != 200:
-                    raise RuntimeError(f"OpenRouter returned {resp.status}")
-                data = await resp.json()
-                answer = data["choices"][0]["message"]["content"]
+        async for delta in stream_openrouter(messages):
+            answer += delta
+            await overflow(answer)
+            if time.monotonic() - last_edit >= AI_EDIT_INTERVAL and answer[page_start:].strip():
+                await show(answer[page_start:], final=False)
+                last_edit = time.monotonic()
+                if not visible:
+                    visible = True
+                    bot.ai_stats.ttft.append(time.perf_counter() - started)
+        await show(answer[page_start:], final=True)
+        if not visible:
+            bot.ai_stats.ttft.append(time.perf_counter() - started)
     except Exception as e:
+        bot.ai_stats.errors += 1
         logger.error(f"OpenRouter error: {e}")
+        if visible or current is not None:
+            try:  # settle the partial answer so it doesn't keep the typing cursor
+                await show(answer[page_start:], final=True)
+            except discord.HTTPException:
+                pass
         return await interaction.followup.send(embed=make_embed("❌ AI Error", "Failed to get a response from the AI service. Please try again later.", discord.Color.red(), bot.user))
 
     context.append({"role": "assistant", "content": answer})
-    embed = make_embed("🤖 VantixNodes AI", answer[:4000], discord.Color.purple(), bot.user)
-    embed.set_footer(text=f"{BOT_NAME} • Asked by {interaction.user}", icon_url=bot.user.display_avatar.url)
-    await interaction.followup.send(embed=embed)
+    if answer.strip():
+        await ai_cache_set(cache_key, answer)
 
 
 # ==================================================================
@@ -1674,21 +3660,21 @@ async def afk_cmd(interaction: discord.Interaction, reason: str = "AFK"):
 
 
 async def handle_afk(message: discord.Message):
-    key = f"{message.guild.id}:{message.author.id}"
-    info = await cache_get("afk_cache", key)
+    # author + every mentioned user in a single cache round-trip
+    mentioned = [u for u in dict.fromkeys(message.mentions) if u.id != message.author.id]
+    keys = [f"{message.guild.id}:{u.id}" for u in [message.author, *mentioned]]
+    info, *mention_infos = await cache_get_many("afk_cache", keys)
+
     if info is not None:
-        await cache_delete("afk_cache", key)
+        await cache_delete("afk_cache", keys[0])
         embed = make_embed("👋 Welcome Back", f"{message.author.mention}, I've removed your AFK status.", discord.Color.green(), bot.user)
         await message.channel.send(embed=embed, delete_after=10)
 
-    if message.mentions:
-        for user in message.mentions:
-            mkey = f"{message.guild.id}:{user.id}"
-            minfo = await cache_get("afk_cache", mkey)
-            if minfo is not None:
-                since = int(time.time() - minfo["time"])
-                embed = make_embed("💤 AFK", f"{user.mention} is AFK: {minfo['reason']} ({since}s ago)", discord.Color.blurple(), bot.user)
-                await message.channel.send(embed=embed, delete_after=10)
+    for user, minfo in zip(mentioned, mention_infos):
+        if minfo is not None:
+            since = int(time.time() - minfo["time"])
+            embed = make_embed("💤 AFK", f"{user.mention} is AFK: {minfo['reason']} ({since}s ago)", discord.Color.blurple(), bot.user)
+            await message.channel.send(embed=embed, delete_after=10)
 
 
 # ==================================================================
@@ -1711,6 +3697,77 @@ async def about_cmd(interaction: discord.Interaction):
 # 24. REACTION-ROLE SYSTEM
 # ==================================================================
 
+# message_id -> {emoji: role_id}. The outer keys double as the set of tracked
+# panel messages, so reactions on any other message are rejected in O(1).
+bot.reaction_roles: dict[int, dict[str, int]] = {}
+bot.reaction_roles_loaded = False
+bot.reaction_roles_loading: dict[str, asyncio.Task] = {}
+
+
+bot.reaction_roles_early: Optional[list] = None  # changes seen while a full load runs
+
+
+def _apply_reaction_role_change(index: dict[int, dict[str, int]], change: dict):
+    emojis = index.setdefault(change["message_id"], {})
+    if change["role_id"] is None:
+        emojis.pop(change["emoji"], None)
+    else:
+        emojis[change["emoji"]] = change["role_id"]
+    if not emojis:
+        index.pop(change["message_id"], None)
+
+
+@on_invalidate("reaction_roles")
+def _invalidate_reaction_roles(change: Optional[dict]):
+    """`change` is {"message_id", "emoji", "role_id"}; role_id None removes it."""
+    if bot.reaction_roles_early is not None:
+        bot.reaction_roles_early.append(change)
+    if change is None:
+        bot.reaction_roles.clear()
+        bot.reaction_roles_loaded = False
+        return
+    _apply_reaction_role_change(bot.reaction_roles, change)
+
+
+async def load_reaction_roles():
+    async def load():
+        # Changes published while the pages are read may or may not be in
+        # them; replaying them on top is idempotent. A full invalidation
+        # (None) during the load means starting over.
+        while True:
+            bot.reaction_roles_early = []
+            try:
+                index: dict[int, dict[str, int]] = {}
+                page = 1000  # PostgREST's default max rows per response
+                start = 0
+                while True:
+                    res = await db.table("reaction_roles").select("message_id,emoji,role_id").order("message_id").order("emoji").range(start, start + page - 1).execute()
+                    for r in res.data:
+                        index.setdefault(r["message_id"], {})[r["emoji"]] = r["role_id"]
+                    if len(res.data) < page:
+                        break
+                    start += page
+                early = bot.reaction_roles_early
+            finally:
+                bot.reaction_roles_early = None
+            if None in early:
+                continue
+            for change in early:
+                _apply_reaction_role_change(index, change)
+            break
+        bot.reaction_roles = index
+        bot.reaction_roles_loaded = True
+        logger.info(f"Loaded reaction roles for {len(index)} messages.")
+    await single_flight(bot.reaction_roles_loading, "all", load)
+
+
+async def get_reaction_role(message_id: int, emoji: str) -> Optional[int]:
+    if not bot.reaction_roles_loaded:
+        await load_reaction_roles()
+    emojis = bot.reaction_roles.get(message_id)
+    return emojis.get(emoji) if emojis else None
+
+
 reactionrole_group = app_commands.Group(name="reactionrole", description="Manage reaction roles")
 
 
@@ -1728,10 +3785,11 @@ async def reactionrole_add(interaction: discord.Interaction, message_id: str, em
     except discord.HTTPException:
         return await interaction.response.send_message(embed=make_embed("❌ Error", "Invalid emoji.", discord.Color.red(), bot.user), ephemeral=True)
 
-    supabase.table("reaction_roles").upsert({
+    await db.table("reaction_roles").upsert({
         "guild_id": interaction.guild_id, "channel_id": channel.id, "message_id": int(message_id),
         "emoji": emoji, "role_id": role.id,
     }, on_conflict="message_id,emoji").execute()
+    await publish_invalidation("reaction_roles", {"message_id": int(message_id), "emoji": emoji, "role_id": role.id})
 
     await interaction.response.send_message(embed=make_embed("✅ Reaction Role Added", f"{emoji} → {role.mention} on that message.", discord.Color.green(), bot.user), ephemeral=True)
 
@@ -1739,7 +3797,8 @@ async def reactionrole_add(interaction: discord.Interaction, message_id: str, em
 @reactionrole_group.command(name="remove", description="Remove a reaction role mapping")
 @has_admin_perms()
 async def reactionrole_remove(interaction: discord.Interaction, message_id: str, emoji: str):
-    supabase.table("reaction_roles").delete().eq("message_id", int(message_id)).eq("emoji", emoji).execute()
+    await db.table("reaction_roles").delete().eq("message_id", int(message_id)).eq("emoji", emoji).execute()
+    await publish_invalidation("reaction_roles", {"message_id": int(message_id), "emoji": emoji, "role_id": None})
     await interaction.response.send_message(embed=make_embed("✅ Reaction Role Removed", "Mapping removed.", discord.Color.green(), bot.user), ephemeral=True)
 
 
@@ -1750,11 +3809,11 @@ bot.tree.add_command(reactionrole_group)
 async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
     if payload.member is None or payload.member.bot:
         return
-    res = supabase.table("reaction_roles").select("*").eq("message_id", payload.message_id).eq("emoji", str(payload.emoji)).execute()
-    if not res.data:
+    role_id = await get_reaction_role(payload.message_id, str(payload.emoji))
+    if role_id is None:
         return
     guild = bot.get_guild(payload.guild_id)
-    role = guild.get_role(res.data[0]["role_id"]) if guild else None
+    role = guild.get_role(role_id) if guild else None
     if guild and role:
         try:
             await payload.member.add_roles(role, reason="Reaction role")
@@ -1764,14 +3823,14 @@ async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
 
 @bot.event
 async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
-    res = supabase.table("reaction_roles").select("*").eq("message_id", payload.message_id).eq("emoji", str(payload.emoji)).execute()
-    if not res.data:
+    role_id = await get_reaction_role(payload.message_id, str(payload.emoji))
+    if role_id is None:
         return
     guild = bot.get_guild(payload.guild_id)
     if not guild:
         return
     member = guild.get_member(payload.user_id)
-    role = guild.get_role(res.data[0]["role_id"])
+    role = guild.get_role(role_id)
     if member and role:
         try:
             await member.remove_roles(role, reason="Reaction role removed")
@@ -1792,6 +3851,42 @@ def xp_for_level(level: int) -> int:
     return 5 * (level ** 2) + 50 * level + 100
 
 
+def total_xp_for_level(level: int) -> int:
+    """Cumulative XP needed to go from level 0 to `level` (sum of xp_for_level)."""
+    return (10 * level ** 3 + 135 * level ** 2 + 455 * level) // 6
+
+
+def level_for_total_xp(total: int) -> int:
+    """Inverse of total_xp_for_level: solve 10L³ + 135L² + 455L = 6·total with
+    Cardano's formula, then settle float rounding with at most a step or two."""
+    # depressed cubic t³ + pt + q = 0 with L = t - 4.5
+    p = -15.25
+    q = -22.5 - 0.6 * total
+    disc = (q / 2) ** 2 + (p / 3) ** 3
+    if disc > 0:
+        root = disc ** 0.5
+        level = max(0, int(math.cbrt(-q / 2 + root) + math.cbrt(-q / 2 - root) - 4.5))
+    else:
+        level = 0
+    while total_xp_for_level(level + 1) <= total:
+        level += 1
+    while level and total_xp_for_level(level) > total:
+        level -= 1
+    return level
+
+
+# Write-behind XP: messages only bump an in-memory counter; xp_flush_loop turns
+# everything gathered since the last tick into one bulk upsert. A guild lives
+# on exactly one shard, so a (guild, user) row is only ever written by the one
+# process that owns that shard — no cross-process read-modify-write race.
+XP_FLUSH_SECONDS = 5
+XP_TOTALS_MAX = 200_000  # cap on remembered per-user totals (LRU)
+
+bot.xp_pending: dict[tuple[int, int], list] = {}           # (guild_id, user_id) -> [gained, channel_id]
+bot.xp_totals: OrderedDict[tuple[int, int], int] = OrderedDict()  # (guild_id, user_id) -> cumulative XP
+bot.xp_flush_lock = asyncio.Lock()
+
+
 async def add_xp(message: discord.Message):
     key = f"{message.guild.id}:{message.author.id}"
     last_award = await cache_get("xp_cooldowns", key, default=0)
@@ -1800,53 +3895,162 @@ async def add_xp(message: discord.Message):
         return
     await cache_set("xp_cooldowns", key, now, ttl=LEVEL_XP_COOLDOWN)
 
-    import random
     gained = random.randint(*XP_PER_MESSAGE)
+    pending = bot.xp_pending.setdefault((message.guild.id, message.author.id), [0, None])
+    pending[0] += gained
+    pending[1] = message.channel.id
 
-    res = supabase.table("levels").select("*").eq("guild_id", message.guild.id).eq("user_id", message.author.id).execute()
-    if res.data:
-        record = res.data[0]
-        new_xp = record["xp"] + gained
-        level = record["level"]
-        leveled_up = False
-        while new_xp >= xp_for_level(level):
-            new_xp -= xp_for_level(level)
-            level += 1
-            leveled_up = True
-        supabase.table("levels").update({"xp": new_xp, "level": level}).eq("id", record["id"]).execute()
-    else:
-        new_xp, level, leveled_up = gained, 0, False
-        supabase.table("levels").insert({"guild_id": message.guild.id, "user_id": message.author.id, "xp": new_xp, "level": level}).execute()
 
-    if leveled_up:
-        embed = make_embed("🎉 Level Up!", f"{message.author.mention} reached **level {level}**!", discord.Color.gold(), bot.user)
+async def flush_xp():
+    async with bot.xp_flush_lock:
+        if not bot.xp_pending:
+            return
+        pending, bot.xp_pending = bot.xp_pending, {}
         try:
-            await message.channel.send(embed=embed)
-        except discord.Forbidden:
-            pass
+            await _flush_xp_batch(pending)
+        except Exception as e:
+            logger.error(f"flush_xp error: {e}")
+        for key, (gained, channel_id) in pending.items():
+            retry = bot.xp_pending.setdefault(key, [0, channel_id])
+            retry[0] += gained
+
+
+async def _flush_xp_batch(pending: dict[tuple[int, int], list]):
+    """Writes `pending` to levels. Committed entries are removed from it, so
+    whatever is left afterwards (or when this raises) still needs writing."""
+    missing: dict[int, list[int]] = {}
+    for guild_id, user_id in pending:
+        if (guild_id, user_id) not in bot.xp_totals:
+            missing.setdefault(guild_id, []).append(user_id)
+    # Stored totals of uncached users, looked up in chunks (PostgREST caps
+    # replies at 1000 rows, long in_() lists overflow the URL). A user counts
+    # as new (total 0) only if their chunk came back; users of a failed chunk
+    # stay pending, since writing them would overwrite their stored XP.
+    known, unresolved = {}, set()
+    for guild_id, user_ids in missing.items():
+        for i in range(0, len(user_ids), 100):
+            chunk = user_ids[i:i + 100]
+            try:
+                res = await db.table("levels").select("user_id,xp,level").eq("guild_id", guild_id).in_("user_id", chunk).execute()
+            except Exception as e:
+                logger.error(f"xp total lookup error: {e}")
+                unresolved.update((guild_id, user_id) for user_id in chunk)
+                continue
+            for user_id in chunk:
+                known[(guild_id, user_id)] = 0
+            for r in res.data:
+                known[(guild_id, r["user_id"])] = total_xp_for_level(r["level"]) + r["xp"]
+
+    rows, totals, level_ups = [], {}, {}
+    for (guild_id, user_id), (gained, channel_id) in pending.items():
+        if (guild_id, user_id) in unresolved:
+            continue
+        old_total = bot.xp_totals.get((guild_id, user_id), known.get((guild_id, user_id), 0))
+        new_total = old_total + gained
+        level = level_for_total_xp(new_total)
+        if level > level_for_total_xp(old_total):
+            level_ups[(guild_id, user_id)] = (channel_id, level)
+        totals[(guild_id, user_id)] = new_total
+        rows.append({"guild_id": guild_id, "user_id": user_id, "xp": new_total - total_xp_for_level(level), "level": level})
+
+    # Each chunk's totals are applied (and its keys dropped from `pending`) as
+    # soon as it commits, so a later failing chunk re-queues only its own rows.
+    announce = []
+    try:
+        for i in range(0, len(rows), 500):
+            chunk = rows[i:i + 500]
+            await db.table("levels").upsert(chunk, on_conflict="guild_id,user_id").execute()
+
+            top_changed = set()
+            for row in chunk:
+                key = (row["guild_id"], row["user_id"])
+                total = totals[key]
+                was_top = xp_rank.in_top(key[0], key[1], XP_LEADERBOARD_PAGE)
+                xp_rank.update(key[0], key[1], total)
+                if was_top or xp_rank.in_top(key[0], key[1], XP_LEADERBOARD_PAGE):
+                    top_changed.add(key[0])
+                bot.xp_totals[key] = total
+                bot.xp_totals.move_to_end(key)
+                del pending[key]
+                if key in level_ups:
+                    announce.append((key[1], *level_ups[key]))
+            for guild_id in top_changed:
+                bot.xp_leaderboard_rendered.delete(guild_id)
+            while len(bot.xp_totals) > XP_TOTALS_MAX:
+                bot.xp_totals.popitem(last=False)
+    finally:
+        for user_id, channel_id, level in announce:
+            channel = bot.get_channel(channel_id)
+            if not channel:
+                continue
+            embed = make_embed("🎉 Level Up!", f"<@{user_id}> reached **level {level}**!", discord.Color.gold(), bot.user)
+            try:
+                await channel.send(embed=embed)
+            except discord.HTTPException:
+                pass
+
+
+@tasks.loop(seconds=XP_FLUSH_SECONDS)
+async def xp_flush_loop():
+    await flush_xp()
+
+
+# Members ranked by cumulative XP in a RankedIndex, kept current by each XP
+# flush. The rendered first page is cached per guild and dropped only when a
+# flush touches someone inside the top XP_LEADERBOARD_PAGE.
+XP_LEADERBOARD_PAGE = 10
+
+
+async def _load_xp_rank(guild_id: int) -> dict[int, int]:
+    rows = await select_all(lambda: db.table("levels").select("user_id,xp,level").eq("guild_id", guild_id).order("user_id"))
+    return {r["user_id"]: total_xp_for_level(r["level"]) + r["xp"] for r in rows}
+
+
+xp_rank = RankedIndex(_load_xp_rank)
+bot.xp_leaderboard_rendered = LocalLRUCache(max_size=5000, ttl=3600)
+
+
+def render_xp_leaderboard(entries: list[tuple[int, int]], start: int) -> str:
+    lines = []
+    for i, (user_id, total) in enumerate(entries, start=start + 1):
+        level = level_for_total_xp(total)
+        lines.append(f"**{i}.** <@{user_id}> — Level {level} ({total - total_xp_for_level(level)} XP)")
+    return "\n".join(lines)
 
 
 @bot.tree.command(name="rank", description="View your (or another member's) level and XP")
 async def rank_cmd(interaction: discord.Interaction, member: Optional[discord.Member] = None):
     member = member or interaction.user
-    res = supabase.table("levels").select("*").eq("guild_id", interaction.guild_id).eq("user_id", member.id).execute()
+    res = await db.table("levels").select("*").eq("guild_id", interaction.guild_id).eq("user_id", member.id).execute()
     if not res.data:
         return await interaction.response.send_message(embed=make_embed("📈 Rank", f"{member.mention} hasn't earned any XP yet.", discord.Color.blurple(), bot.user))
     record = res.data[0]
     needed = xp_for_level(record["level"])
+    ranked = await xp_rank.rank(interaction.guild_id, member.id)
     embed = make_embed(f"📈 Rank — {member}", color=discord.Color.blurple(), bot_user=bot.user)
     embed.add_field(name="Level", value=str(record["level"]), inline=True)
     embed.add_field(name="XP", value=f"{record['xp']}/{needed}", inline=True)
+    if ranked:
+        embed.add_field(name="Rank", value=f"#{ranked[0]} of {ranked[1]}", inline=True)
     await interaction.response.send_message(embed=embed)
 
 
 @bot.tree.command(name="levelleaderboard", description="View the server's XP leaderboard")
-async def levelleaderboard_cmd(interaction: discord.Interaction):
-    res = supabase.table("levels").select("*").eq("guild_id", interaction.guild_id).order("level", desc=True).order("xp", desc=True).limit(10).execute()
-    if not res.data:
-        return await interaction.response.send_message(embed=make_embed("🏆 XP Leaderboard", "No data yet.", discord.Color.blurple(), bot.user))
-    desc = "\n".join(f"**{i+1}.** <@{r['user_id']}> — Level {r['level']} ({r['xp']} XP)" for i, r in enumerate(res.data))
-    await interaction.response.send_message(embed=make_embed("🏆 XP Leaderboard", desc, discord.Color.gold(), bot.user))
+async def levelleaderboard_cmd(interaction: discord.Interaction, page: app_commands.Range[int, 1] = 1):
+    start = (page - 1) * XP_LEADERBOARD_PAGE
+    desc = bot.xp_leaderboard_rendered.get(interaction.guild_id) if page == 1 else None
+    total = None
+    if desc is None:
+        entries, total = await xp_rank.page(interaction.guild_id, start, XP_LEADERBOARD_PAGE)
+        if not entries:
+            return await interaction.response.send_message(embed=make_embed("🏆 XP Leaderboard", "No data yet." if page == 1 else "No members on that page.", discord.Color.blurple(), bot.user))
+        desc = render_xp_leaderboard(entries, start)
+        if page == 1:
+            bot.xp_leaderboard_rendered.set(interaction.guild_id, desc)
+    embed = make_embed("🏆 XP Leaderboard", desc, discord.Color.gold(), bot.user)
+    if page > 1 and total:
+        embed.set_footer(text=f"{BOT_NAME} • Page {page} of {-(-total // XP_LEADERBOARD_PAGE)}", icon_url=bot.user.display_avatar.url)
+    await interaction.response.send_message(embed=embed)
 
 
 # ==================================================================
@@ -1860,7 +4064,7 @@ async def levelleaderboard_cmd(interaction: discord.Interaction):
 async def backup_cmd(interaction: discord.Interaction, label: str = "manual"):
     cfg = await get_guild_config(interaction.guild_id)
     snapshot = {k: v for k, v in cfg.items() if k != "guild_id"}
-    res = supabase.table("guild_backups").insert({
+    res = await db.table("guild_backups").insert({
         "guild_id": interaction.guild_id, "label": label, "snapshot": json.dumps(snapshot),
         "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
     }).execute()
@@ -1871,7 +4075,7 @@ async def backup_cmd(interaction: discord.Interaction, label: str = "manual"):
 @bot.tree.command(name="restore", description="Restore this server's VantixNodes configuration from a backup")
 @has_admin_perms()
 async def restore_cmd(interaction: discord.Interaction, backup_id: int):
-    res = supabase.table("guild_backups").select("*").eq("id", backup_id).eq("guild_id", interaction.guild_id).execute()
+    res = await db.table("guild_backups").select("*").eq("id", backup_id).eq("guild_id", interaction.guild_id).execute()
     if not res.data:
         return await interaction.response.send_message(embed=make_embed("❌ Error", "Backup not found for this server.", discord.Color.red(), bot.user), ephemeral=True)
     snapshot = json.loads(res.data[0]["snapshot"])
@@ -1882,7 +4086,7 @@ async def restore_cmd(interaction: discord.Interaction, backup_id: int):
 @bot.tree.command(name="backuplist", description="List available configuration backups for this server")
 @has_admin_perms()
 async def backuplist_cmd(interaction: discord.Interaction):
-    res = supabase.table("guild_backups").select("id,label,created_at").eq("guild_id", interaction.guild_id).order("created_at", desc=True).limit(10).execute()
+    res = await db.table("guild_backups").select("id,label,created_at").eq("guild_id", interaction.guild_id).order("created_at", desc=True).limit(10).execute()
     if not res.data:
         return await interaction.response.send_message(embed=make_embed("💾 Backups", "No backups yet. Use `/backup` to create one.", discord.Color.blurple(), bot.user), ephemeral=True)
     desc = "\n".join(f"**#{b['id']}** — `{b['label']}` ({b['created_at'][:19]})" for b in res.data)
@@ -1933,7 +4137,7 @@ async def review_cmd(interaction: discord.Interaction, rate: app_commands.Range[
     embed.add_field(name="Rating", value=stars, inline=False)
     embed_footer(embed, bot.user)
 
-    supabase.table("reviews").insert({
+    await db.table("reviews").insert({
         "guild_id": interaction.guild_id, "user_id": interaction.user.id,
         "rating": rate, "description": description,
         "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
@@ -2042,7 +4246,78 @@ async def setstatus_cmd(interaction: discord.Interaction, status: Literal["onlin
 # 33. ANTI-SPAM SYSTEM
 # ==================================================================
 
-bot.antispam_tracker: dict[tuple, list] = {}  # (guild_id, user_id) -> list of message timestamps
+ANTISPAM_MAX_KEYS = 100_000     # hard cap on tracked (guild, user) pairs, LRU-evicted
+ANTISPAM_IDLE_SECONDS = 300     # buckets untouched this long are dropped by the sweeper
+
+
+class _SpamBucket:
+    __slots__ = ("events", "last_seen")
+
+    def __init__(self, size: int, events=()):
+        self.events = deque(events, maxlen=size)
+        self.last_seen = 0.0
+
+
+class SpamTracker:
+    """Per-(guild, user) message timestamps in fixed-size ring buffers (sized to
+    the guild's threshold — nothing older is ever needed), ordered by last use
+    so both the sweeper and the LRU cap only touch the stale end. With Redis
+    the counting is delegated to a SlidingWindowCounter so floods spread
+    across shards are still counted together."""
+
+    def __init__(self, max_keys: int, idle_seconds: float):
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        self.buckets: OrderedDict[tuple[int, int], _SpamBucket] = OrderedDict()
+        self.evictions = 0
+        self.counter = SlidingWindowCounter("antispam")
+
+    async def hit(self, key: tuple[int, int], window: float, threshold: int) -> int:
+        """Record one message; returns the in-window count and resets on trip."""
+        threshold = max(1, threshold)
+        if bot.redis:
+            return await self.counter.hit(f"{key[0]}:{key[1]}", window, trip_at=threshold)
+
+        now = time.time()
+        bucket = self.buckets.get(key)
+        if bucket is None or bucket.events.maxlen != threshold:
+            bucket = self.buckets[key] = _SpamBucket(threshold, bucket.events if bucket else ())
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+                self.evictions += 1
+        self.buckets.move_to_end(key)
+        bucket.last_seen = now
+
+        events = bucket.events
+        events.append(now)
+        while events and events[0] <= now - window:
+            events.popleft()
+        total = len(events)
+        if total >= threshold:
+            events.clear()
+        return total
+
+    def summary(self) -> str:
+        if bot.redis:
+            return "counted in Redis"
+        return f"{len(self.buckets)} tracked / {self.evictions} evicted"
+
+    def sweep(self):
+        cutoff = time.time() - self.idle_seconds
+        while self.buckets:
+            key, bucket = next(iter(self.buckets.items()))
+            if bucket.last_seen > cutoff:
+                break
+            del self.buckets[key]
+
+
+bot.antispam_tracker = SpamTracker(ANTISPAM_MAX_KEYS, ANTISPAM_IDLE_SECONDS)
+
+
+@tasks.loop(seconds=60)
+async def antispam_sweeper():
+    bot.antispam_tracker.sweep()
+
 
 antispam_group = app_commands.Group(name="antispam", description="Configure anti-spam protection")
 
@@ -2074,26 +4349,14 @@ async def antispam_config(interaction: discord.Interaction, messages: int, secon
 bot.tree.add_command(antispam_group)
 
 
-async def handle_antispam(message: discord.Message):
-    cfg = await get_guild_config(message.guild.id)
-    if not cfg.get("antispam_enabled"):
-        return
-    if message.author.guild_permissions.manage_messages:
-        return
-
+async def handle_antispam(message: discord.Message, cfg: dict) -> bool:
+    """Returns True if the author tripped the flood threshold (and was punished)."""
     threshold = cfg.get("antispam_threshold", 5)
     window = cfg.get("antispam_window", 5)
     punishment = cfg.get("antispam_punishment", "timeout")
 
-    key = (message.guild.id, message.author.id)
-    now = time.time()
-    events = bot.antispam_tracker.setdefault(key, [])
-    events.append(now)
-    events[:] = [t for t in events if now - t <= window]
-
-    if len(events) < threshold:
-        return
-    events.clear()
+    if await bot.antispam_tracker.hit((message.guild.id, message.author.id), window, threshold) < threshold:
+        return False
 
     try:
         await message.channel.purge(limit=threshold, check=lambda m: m.author.id == message.author.id)
@@ -2122,6 +4385,7 @@ async def handle_antispam(message: discord.Message):
     embed.add_field(name="Channel", value=message.channel.mention, inline=True)
     embed.add_field(name="Action Taken", value=action_taken, inline=False)
     await log_to_channel(message.guild, cfg.get("modlog_channel"), embed)
+    return True
 
 
 # ==================================================================
@@ -2131,13 +4395,29 @@ async def handle_antispam(message: discord.Message):
 @bot.event
 async def on_ready():
     logger.info(f"Logged in as {bot.user} ({bot.user.id})")
-    await on_ready_populate_invites()
-    if not giveaway_checker.is_running():
-        giveaway_checker.start()
+    if bot.redis and bot.invalidation_task is None:
+        bot.invalidation_task = asyncio.create_task(invalidation_listener())
+    if bot.invite_warmup_task is None:
+        bot.invite_warmup_task = asyncio.create_task(warm_invite_cache())
+    if bot.invite_backfill_task is None:
+        bot.invite_backfill_task = asyncio.create_task(backfill_invite_counters())
+    try:
+        await giveaway_scheduler.start()
+    except Exception as e:
+        logger.error(f"Giveaway scheduler start failed: {e}")
     if not status_monitor_loop.is_running():
         status_monitor_loop.start()
     if not dm_queue_worker.is_running():
         dm_queue_worker.start()
+    if not xp_flush_loop.is_running():
+        xp_flush_loop.start()
+    if not antispam_sweeper.is_running():
+        antispam_sweeper.start()
+    if not bot.reaction_roles_loaded:
+        try:
+            await load_reaction_roles()
+        except Exception as e:
+            logger.error(f"Reaction role preload failed: {e}")
     try:
         synced = await bot.tree.sync()
         logger.info(f"Synced {len(synced)} slash commands.")
@@ -2146,9 +4426,35 @@ async def on_ready():
     await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="VantixNodes | /about"))
 
 
+async def setup_bot():
+    get_http_session()
+
+
+bot.setup_hook = setup_bot
+
+_bot_close = bot.close
+
+
+async def close_bot():
+    """Flush write-behind buffers before disconnecting, then release the HTTP pool."""
+    await flush_xp()
+    await dm_dispatcher.checkpoint_all()
+    await status_history.flush(include_open=True)
+    await _bot_close()
+    if bot.http_session is not None:
+        await bot.http_session.close()
+
+
+bot.close = close_bot
+
+
 @bot.event
 async def on_guild_join(guild):
-    bot.invite_cache[guild.id] = {}
+    if guild.me.guild_permissions.manage_guild:
+        try:
+            await store_invite_snapshots({guild.id: invite_snapshot(await guild.invites())})
+        except discord.HTTPException:
+            pass
     await get_guild_config(guild.id)
     logger.info(f"Joined guild: {guild.name} ({guild.id})")
 